@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Runs pipeline extraction on a worker thread so slider callbacks return
+immediately. Only the newest request is kept: submitting a new one cancels
+the one in flight and any result it produced afterwards is dropped.
+"""
+import threading
+import traceback
+
+class CancellationToken:
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+# extract(request, token) is a generator yielding successively finer results
+# (e.g. a coarse preview, then the full resolution mesh). It should check
+# token.cancelled between stages and return early once it is set.
+class BackgroundExtractor:
+    def __init__(self, extract):
+        self.extract = extract
+        self.condition = threading.Condition()
+        self.pending = None
+        self.token = None
+        self.result = None
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name='extraction', daemon=True)
+        self.thread.start()
+
+    def submit(self, request):
+        with self.condition:
+            if(self.token):
+                self.token.cancel()
+            self.token = CancellationToken()
+            self.pending = (request, self.token)
+            self.condition.notify()
+        return self.token
+
+    def run(self):
+        while True:
+            with self.condition:
+                while(self.pending is None and not self.stopped):
+                    self.condition.wait()
+                if(self.stopped):
+                    return
+                request, token = self.pending
+                self.pending = None
+            try:
+                for result in self.extract(request, token):
+                    if(token.cancelled):
+                        break
+                    with self.condition:
+                        self.result = (token, result)
+            except Exception:
+                traceback.print_exc()
+
+    # newest result not superseded yet, or None. Call from the GUI thread.
+    def poll(self):
+        with self.condition:
+            result, self.result = self.result, None
+        if(result is None or result[0].cancelled):
+            return None
+        return result[1]
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            if(self.token):
+                self.token.cancel()
+            self.condition.notify()
+        self.thread.join()
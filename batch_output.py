@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch mode: the pipeline runs without an interactor, the meshes of
+the actors are written to .vtp/.ply/.stl and/or an offscreen render to PNG,
+then the script exits.
+"""
+import os
+
+import vtk
+
+mesh_writers = {
+    ".vtp": vtk.vtkXMLPolyDataWriter,
+    ".ply": vtk.vtkPLYWriter,
+    ".stl": vtk.vtkSTLWriter,
+}
+
+def add_batch_arguments(parser):
+    parser.add_argument('--batch', dest='batch', action='store_true',
+                        help='run without a window, write --output and/or --screenshot and exit')
+    parser.add_argument('--output', dest='output', default=None,
+                        help='mesh file (.vtp, .ply or .stl), numbered when there are several actors')
+    parser.add_argument('--screenshot', dest='screenshot', default=None, help='offscreen render (.png)')
+    parser.add_argument('--size', dest='size', nargs=2, type=int, default=[1024, 768],
+                        help='size of the offscreen render')
+    return parser
+
+# None without --batch, otherwise the batch outputs.
+def batch_options(parser, args):
+    if(not args.batch):
+        return None
+    if(not args.output and not args.screenshot):
+        parser.error('--batch needs --output and/or --screenshot')
+    if(args.output and os.path.splitext(args.output)[1].lower() not in mesh_writers):
+        parser.error('--output must end in one of ' + ', '.join(mesh_writers))
+    return {'output': args.output, 'screenshot': args.screenshot, 'size': args.size}
+
+# file_name for the actor at index, numbered when there are several.
+def numbered_file(file_name, index, count):
+    if(count == 1):
+        return file_name
+    path, extension = os.path.splitext(file_name)
+    return path + '_' + str(index) + extension
+
+def actor_mesh(actor):
+    mapper = actor.GetMapper()
+    mapper.Update()
+    return mapper.GetInput()
+
+def write_mesh(mesh, file_name):
+    writer = mesh_writers[os.path.splitext(file_name)[1].lower()]()
+    writer.SetFileName(file_name)
+    if(isinstance(writer, vtk.vtkXMLPolyDataWriter)):
+        writer.SetDataModeToAppended()
+        writer.SetCompressorTypeToZLib()
+        writer.SetInputData(mesh)
+    else:
+        # ply and stl only store triangles
+        writer.SetFileTypeToBinary()
+        triangles = vtk.vtkTriangleFilter()
+        triangles.SetInputData(mesh)
+        writer.SetInputConnection(triangles.GetOutputPort())
+    if(not writer.Write()):
+        print('Could not write ' + file_name)
+        return False
+    return True
+
+def write_actor_meshes(actors, file_name):
+    written = []
+    for index, actor in enumerate(actors):
+        name = numbered_file(file_name, index, len(actors))
+        if(write_mesh(actor_mesh(actor), name)):
+            written.append(name)
+    return written
+
+# same camera as the interactive windows.
+def render_offscreen(actors, file_name, size, zoom=1):
+    renderer = vtk.vtkRenderer()
+    renderer_window = vtk.vtkRenderWindow()
+    renderer_window.SetOffScreenRendering(1)
+    renderer_window.AddRenderer(renderer)
+    renderer_window.SetSize(size[0], size[1])
+    if(any(actor.GetProperty().GetOpacity() < 1 for actor in actors)):
+        renderer_window.SetAlphaBitPlanes(1)
+        renderer_window.SetMultiSamples(0)
+        renderer.SetUseDepthPeeling(1)
+        renderer.SetMaximumNumberOfPeels(100)
+        renderer.SetOcclusionRatio(0.1)
+    for actor in actors:
+        renderer.AddActor(actor)
+    renderer.ResetCamera()
+    renderer.GetActiveCamera().Roll(200)
+    renderer.GetActiveCamera().Elevation(90)
+    renderer.GetActiveCamera().Azimuth(0)
+    renderer.SetBackground(0.1, 0.1, 0.1)
+    renderer.ResetCameraClippingRange()
+    renderer.GetActiveCamera().Zoom(zoom)
+    renderer_window.Render()
+
+    image = vtk.vtkWindowToImageFilter()
+    image.SetInput(renderer_window)
+    image.ReadFrontBufferOff()
+    writer = vtk.vtkPNGWriter()
+    writer.SetFileName(file_name)
+    writer.SetInputConnection(image.GetOutputPort())
+    writer.Write()
+    renderer_window.Finalize()
+    return file_name
+
+def run_batch(actors, options, zoom=1):
+    if(options['output']):
+        for name in write_actor_meshes(actors, options['output']):
+            print('Wrote ' + name)
+    if(options['screenshot']):
+        print('Wrote ' + render_offscreen(actors, options['screenshot'], options['size'], zoom))
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the generate_actors path of isosurface, isogm, iso2dtf and
+isocomplete on synthetic volumes: a sphere distance field, a gyroid and
+band-limited noise, from 64^3 up to 1024^3. Every volume is written once as a
+.vti with its gradient magnitude, isovalue, params and transfer function
+files. Each (tool, field, size) case then runs the tool headless in a fresh
+process, so the peak RSS recorded is its own.
+
+Results are written as JSON. With --baseline they are compared with a previous
+results file, and a slower extraction, a larger peak RSS or a different
+triangle count makes the exit status non-zero.
+"""
+import contextlib
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from contour_engine import add_engine_argument
+from gradient_volume import gradient_cache_file, load_gradient_magnitude
+from mmap_reader import scalar_range
+
+tools = ["isosurface", "isogm", "iso2dtf", "isocomplete"]
+field_names = ["sphere", "gyroid", "noise"]
+# z slices generated at once, so the 1024^3 volumes only need their own memory
+field_slab = 32
+# the fields span 0..255, like the 8 bit volumes the tools were written for
+field_max = 255.0
+# isovalues as fractions of field_max
+iso_fractions = [0.25, 0.5, 0.75]
+# sine waves summed into the noise field
+noise_waves = 24
+
+def get_program_parameters():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tools', dest='tools', nargs='+', choices=tools, default=tools)
+    parser.add_argument('--fields', dest='fields', nargs='+', choices=field_names, default=field_names)
+    parser.add_argument('--sizes', dest='sizes', nargs='+', type=int, default=[64, 128],
+                        help='edge lengths of the volumes (64 to 1024)')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3,
+                        help='runs of every case, each in a fresh process')
+    parser.add_argument('--seed', dest='seed', type=int, default=0, help='seed of the noise field')
+    parser.add_argument('--data-dir', dest='data_dir', default='benchmark_data',
+                        help='directory the synthetic volumes are written to and reused from')
+    parser.add_argument('--output', dest='output', default='benchmark.json', help='results (.json)')
+    parser.add_argument('--baseline', dest='baseline', default=None,
+                        help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.1,
+                        help='relative slowdown or RSS growth over the baseline still accepted')
+    add_engine_argument(parser)
+    args = parser.parse_args()
+    for size in args.sizes:
+        if(size < 64 or size > 1024):
+            parser.error('--sizes must be between 64 and 1024')
+
+    return args.tools, args.fields, args.sizes, args.repeat, args.seed, args.data_dir, args.output, args.baseline, args.tolerance, args.engine
+
+# x, y, z in -1..1 of the slices z0..z1 of a size^3 volume, as broadcastable grids.
+def slab_coordinates(size, z0, z1):
+    axis = np.linspace(-1, 1, size, dtype=np.float32)
+    return axis[None, None, :], axis[None, :, None], axis[z0:z1, None, None]
+
+def sphere_field(x, y, z, seed):
+    return field_max * (1 - np.sqrt(x * x + y * y + z * z) / np.sqrt(3))
+
+def gyroid_field(x, y, z, seed):
+    x, y, z = 2 * np.pi * x, 2 * np.pi * y, 2 * np.pi * z
+    gyroid = np.sin(x) * np.cos(y) + np.sin(y) * np.cos(z) + np.sin(z) * np.cos(x)
+    return field_max * (gyroid + 1.5) / 3
+
+# sine waves of random directions, frequencies and phases, so the noise is
+# smooth, reproducible from seed and computable slice by slice.
+def noise_field(x, y, z, seed):
+    rng = np.random.default_rng(seed)
+    directions = rng.normal(size=(noise_waves, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    frequencies = rng.uniform(1, 8, noise_waves) * np.pi
+    phases = rng.uniform(0, 2 * np.pi, noise_waves)
+    amplitudes = 1 / frequencies
+    noise = 0
+    for direction, frequency, phase, amplitude in zip(directions, frequencies, phases, amplitudes):
+        noise = noise + amplitude * np.sin(frequency * (direction[0] * x + direction[1] * y + direction[2] * z) + phase)
+    return field_max * (noise / amplitudes.sum() + 1) / 2
+
+fields = {'sphere': sphere_field, 'gyroid': gyroid_field, 'noise': noise_field}
+
+def synthetic_volume(field, size, seed):
+    volume = np.empty((size, size, size), dtype=np.float32)
+    for z0 in range(0, size, field_slab):
+        z1 = min(z0 + field_slab, size)
+        volume[z0:z1] = fields[field](*slab_coordinates(size, z0, z1), seed)
+    return volume
+
+# raw appended data, like the gradient caches, so --mmap can map it.
+def write_volume(volume, file_name):
+    array = numpy_support.numpy_to_vtk(volume.ravel(), deep=False)
+    array.SetName("scalars")
+    image = vtk.vtkImageData()
+    size = volume.shape
+    image.SetExtent(0, size[2] - 1, 0, size[1] - 1, 0, size[0] - 1)
+    image.GetPointData().SetScalars(array)
+    writer = vtk.vtkXMLImageDataWriter()
+    writer.SetFileName(file_name)
+    writer.SetInputData(image)
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    writer.SetCompressorTypeToNone()
+    if(not writer.Write()):
+        raise OSError('Could not write ' + file_name)
+
+def write_lines(file_name, rows):
+    with open(file_name, 'w') as file:
+        for row in rows:
+            file.write(' '.join('{:g}'.format(value) for value in row) + '\n')
+
+# the data, gradient and text files of field at size, generated on first use.
+def volume_files(data_dir, field, size, seed):
+    base = os.path.join(data_dir, '{}_{}_{}'.format(field, size, seed))
+    files = {'data': base + '.vti', 'grad': gradient_cache_file(base + '.vti'), 'isovalues': base + '.iso.txt',
+             'params': base + '.params.txt', 'tf': base + '.tf.txt'}
+    if(all(os.path.exists(name) for name in files.values())):
+        return files
+    os.makedirs(data_dir, exist_ok=True)
+    print('Generating ' + files['data'])
+    write_volume(synthetic_volume(field, size, seed), files['data'])
+    reader = vtk.vtkXMLImageDataReader()
+    reader.SetFileName(files['data'])
+    reader.Update()
+    # computed and cached next to the data file, where the tools look for it
+    gradient = load_gradient_magnitude(files['data'], reader).GetOutput()
+    top = scalar_range(gradient)[1]
+
+    values = [fraction * field_max for fraction in iso_fractions]
+    write_lines(files['isovalues'], [[value] for value in values])
+    # one gradient window per isovalue: everything, the flat half, the steep half
+    windows = [(0, top), (0, top / 2), (top / 2, top)]
+    colors = [(255, 0, 0, 255), (0, 255, 0, 128), (0, 0, 255, 255)]
+    write_lines(files['params'], [[value, low, high] + list(color)
+                                  for value, (low, high), color in zip(values, windows, colors)])
+    write_lines(files['tf'], [[values[0], values[2], 0, top / 2, 255, 128, 0, 255]])
+    return files
+
+def tool_arguments(tool, files, engine):
+    value = str(int(iso_fractions[1] * field_max))
+    arguments = {
+        'isosurface': [files['data'], '--val', value],
+        'isogm': [files['data'], files['grad'], files['isovalues']],
+        'iso2dtf': [files['data'], files['grad'], '--val', value, '--tf', files['tf']],
+        'isocomplete': [files['data'], files['grad'], files['params']],
+    }[tool]
+    return arguments + ['--engine', engine]
+
+# bytes, the largest resident set of this process so far.
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# runs in a fresh process: the tool's headless batch path, with its
+# generate_actors timed until every mapper input is up to date.
+def run_case(case):
+    module = importlib.import_module(case['tool'])
+    generate_actors = module.generate_actors
+    measured = {}
+
+    def timed_generate_actors(*args, **kwargs):
+        rss = peak_rss()
+        start = time.perf_counter()
+        actors = generate_actors(*args, **kwargs)
+        for actor in actors:
+            actor.GetMapper().Update()
+        measured['extract'] = time.perf_counter() - start
+        measured['triangles'] = sum(actor.GetMapper().GetInput().GetNumberOfCells() for actor in actors)
+        measured['peak_rss'] = peak_rss()
+        measured['rss_growth'] = measured['peak_rss'] - rss
+        return actors
+    module.generate_actors = timed_generate_actors
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        sys.argv = [case['tool'] + '.py'] + case['arguments'] + ['--batch', '--output', os.path.join(output_dir, 'mesh.vtp')]
+        with contextlib.redirect_stdout(io.StringIO()):
+            module.main()
+    return measured
+
+def run_in_fresh_process(case):
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(run_case, case).result()
+
+def case_key(result):
+    return (result['tool'], result['field'], result['size'])
+
+# median extraction time over the repeats, the largest peak RSS.
+def summarize(case, runs):
+    result = {key: case[key] for key in ('tool', 'field', 'size')}
+    result['extract'] = statistics.median(run['extract'] for run in runs)
+    result['extract_min'] = min(run['extract'] for run in runs)
+    result['triangles'] = runs[-1]['triangles']
+    result['peak_rss'] = max(run['peak_rss'] for run in runs)
+    result['rss_growth'] = max(run['rss_growth'] for run in runs)
+    result['runs'] = len(runs)
+    return result
+
+# the results with a 'baseline' entry and the regressions among them.
+def compare(results, baseline, tolerance):
+    previous = {case_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result))
+        if(old is None):
+            continue
+        problems = []
+        if(result['extract'] > old['extract'] * (1 + tolerance)):
+            problems.append('extract')
+        if(result['peak_rss'] > old['peak_rss'] * (1 + tolerance)):
+            problems.append('peak_rss')
+        if(result['triangles'] != old['triangles']):
+            problems.append('triangles')
+        result['baseline'] = {'extract': old['extract'], 'peak_rss': old['peak_rss'],
+                              'triangles': old['triangles'], 'regressions': problems}
+        if(problems):
+            regressions.append(result)
+    return regressions
+
+def report(result):
+    line = '{tool:<12} {field:<7} {size:>5}^3 extract {extract:8.3f}s {triangles:>10} triangles peak {rss:8.1f} MB'.format(
+        rss=result['peak_rss'] / 2**20, **result)
+    baseline = result.get('baseline')
+    if(baseline):
+        line += '  ({:+.1%} time, {:+.1%} rss{})'.format(
+            result['extract'] / baseline['extract'] - 1, result['peak_rss'] / baseline['peak_rss'] - 1,
+            ', REGRESSION: ' + ' '.join(baseline['regressions']) if baseline['regressions'] else '')
+    print(line)
+
+def main():
+    tool_list, field_list, sizes, repeat, seed, data_dir, output, baseline_file, tolerance, engine = get_program_parameters()
+    baseline = None
+    if(baseline_file):
+        with open(baseline_file) as file:
+            baseline = json.load(file)
+
+    results = []
+    for size in sizes:
+        for field in field_list:
+            files = volume_files(data_dir, field, size, seed)
+            for tool in tool_list:
+                case = {'tool': tool, 'field': field, 'size': size, 'arguments': tool_arguments(tool, files, engine)}
+                runs = [run_in_fresh_process(case) for index in range(repeat)]
+                results.append(summarize(case, runs))
+
+    regressions = compare(results, baseline, tolerance) if baseline else []
+    for result in results:
+        report(result)
+
+    with open(output, 'w') as file:
+        json.dump({'python': platform.python_version(), 'vtk': vtk.vtkVersion.GetVTKVersion(),
+                   'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+                   'engine': engine, 'seed': seed, 'repeat': repeat, 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'results': results}, file, indent=2)
+    print('Wrote ' + output)
+    if(regressions):
+        print(str(len(regressions)) + ' regressions against ' + baseline_file)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Brick-decomposed extraction: the volume is split into fixed-size bricks that
+are contoured and probed one at a time, skipping the bricks whose scalar
+range misses every isovalue.
+"""
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from clip_voi import intersect_extents
+from contour_engine import create_contour_filter
+from mmap_reader import release_pages
+
+def add_brick_argument(parser):
+    parser.add_argument('--bricks', dest='brick_size', type=int, default=0,
+                        help='extract in bricks of this many cells per side (0 extracts the whole volume)')
+    return parser
+
+# (extent, isovalues in range) of every brick of the span index that has at
+# least one isovalue in its range. Bricks share their boundary points, which
+# keeps the brick surfaces crack-free. With region, only the part of every
+# brick inside that extent, and none of the bricks outside it.
+def iter_bricks(index, iso_values, region=None):
+    size = index['size']
+    x0, x1, y0, y1, z0, z1 = index['extent']
+    mins = index['mins']
+    maxs = index['maxs']
+    for k, j, i in np.argwhere(mins <= np.max(iso_values)):
+        values = [value for value in iso_values if mins[k, j, i] <= value <= maxs[k, j, i]]
+        if(not values):
+            continue
+        extent = (x0 + i * size, min(x0 + (i + 1) * size, x1),
+                  y0 + j * size, min(y0 + (j + 1) * size, y1),
+                  z0 + k * size, min(z0 + (k + 1) * size, z1))
+        if(region):
+            extent = intersect_extents(extent, region)
+            if(extent is None):
+                continue
+        yield extent, values
+
+# extent grown by one point on every side, inside whole. Contouring the grown
+# extent gives the points on the brick boundary central difference gradients,
+# so the brick normals match a contour of the whole volume at the seams.
+def ghost_extent(extent, whole):
+    return (max(extent[0] - 1, whole[0]), min(extent[1] + 1, whole[1]),
+            max(extent[2] - 1, whole[2]), min(extent[3] + 1, whole[3]),
+            max(extent[4] - 1, whole[4]), min(extent[5] + 1, whole[5]))
+
+# the cells of surface lying in the cells of extent of image, dropping the ones
+# contoured in the ghost layer and their points. The upper faces of extent
+# belong to the next brick unless they are faces of the whole volume.
+def crop_surface(surface, extent, image):
+    polys = surface.GetPolys()
+    if(not polys.GetNumberOfCells()):
+        return surface
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData())
+    offsets = numpy_support.vtk_to_numpy(polys.GetOffsetsArray())
+    connectivity = numpy_support.vtk_to_numpy(polys.GetConnectivityArray())
+    sizes = np.diff(offsets)
+    centers = np.add.reduceat(points[connectivity].astype(np.float64), offsets[:-1], axis=0) / sizes[:, None]
+    origin = np.array(image.GetOrigin())
+    spacing = np.array(image.GetSpacing())
+    low = origin + spacing * np.array(extent[0::2])
+    high = origin + spacing * np.array(extent[1::2])
+    open_high = np.array(extent[1::2]) < np.array(image.GetExtent()[1::2])
+    keep = np.all(centers >= low, axis=1) & np.all(np.where(open_high, centers < high, centers <= high), axis=1)
+    if(keep.all()):
+        return surface
+    # the ghost points on the seams would otherwise be merged with the next
+    # brick's points, one-sided normals and all.
+    return extract_cells(surface, keep)
+
+# the polygons of surface where keep is set, with only the points they use.
+def extract_cells(surface, keep):
+    polys = surface.GetPolys()
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData())
+    offsets = numpy_support.vtk_to_numpy(polys.GetOffsetsArray())
+    connectivity = numpy_support.vtk_to_numpy(polys.GetConnectivityArray())
+    sizes = np.diff(offsets)
+    used, connectivity = np.unique(connectivity[np.repeat(keep, sizes)], return_inverse=True)
+    extracted = vtk.vtkPolyData()
+    extracted.SetPoints(vtk.vtkPoints())
+    extracted.GetPoints().SetData(numpy_support.numpy_to_vtk(points[used], deep=True))
+    cells = vtk.vtkCellArray()
+    cells.SetData(numpy_support.numpy_to_vtkIdTypeArray(np.concatenate(([0], np.cumsum(sizes[keep]))).astype(np.int64), deep=True),
+                  numpy_support.numpy_to_vtkIdTypeArray(connectivity.astype(np.int64), deep=True))
+    extracted.SetPolys(cells)
+    copy_arrays(surface.GetPointData(), extracted.GetPointData(), used)
+    copy_arrays(surface.GetCellData(), extracted.GetCellData(), np.flatnonzero(keep))
+    return extracted
+
+# the tuples ids of every array of source into target, keeping the active
+# scalars, normals and the other attributes.
+def copy_arrays(source, target, ids):
+    for number in range(source.GetNumberOfArrays()):
+        array = source.GetAbstractArray(number)
+        if(not isinstance(array, vtk.vtkDataArray)):
+            continue
+        copy = numpy_support.numpy_to_vtk(numpy_support.vtk_to_numpy(array)[ids], deep=True, array_type=array.GetDataType())
+        copy.SetName(array.GetName())
+        target.AddArray(copy)
+    for attribute in range(vtk.vtkDataSetAttributes.NUM_ATTRIBUTES):
+        array = source.GetAttribute(attribute)
+        if(array is not None and array.GetName()):
+            target.SetActiveAttribute(array.GetName(), attribute)
+
+def same_geometry(image, other):
+    return (image.GetExtent() == other.GetExtent() and image.GetSpacing() == other.GetSpacing()
+            and image.GetOrigin() == other.GetOrigin())
+
+# yields the contoured and probed surface of one brick at a time. The filters
+# are reused across bricks, so only one brick of the volume (and gradient) is
+# extracted at once. region restricts them to an extent, like iter_bricks.
+def stream_brick_surfaces(data, gradient_magnitude, iso_values, engine, index, region=None):
+    voi = vtk.vtkExtractVOI()
+    voi.SetInputConnection(data.GetOutputPort())
+    iso = create_contour_filter(engine, voi)
+
+    probe = vtk.vtkProbeFilter()
+    probe.SetInputConnection(iso.GetOutputPort())
+    # keeps the contour normals, computed with the ghost layer
+    probe.PassPointArraysOn()
+    gradient_voi = None
+    if(same_geometry(data.GetOutput(), gradient_magnitude.GetOutput())):
+        gradient_voi = vtk.vtkExtractVOI()
+        gradient_voi.SetInputConnection(gradient_magnitude.GetOutputPort())
+        probe.SetSourceConnection(gradient_voi.GetOutputPort())
+    else:
+        probe.SetSourceConnection(gradient_magnitude.GetOutputPort())
+
+    image = data.GetOutput()
+    for extent, values in iter_bricks(index, iso_values, region):
+        voi.SetVOI(*ghost_extent(extent, image.GetExtent()))
+        if(gradient_voi):
+            gradient_voi.SetVOI(*ghost_extent(extent, image.GetExtent()))
+        iso.SetNumberOfContours(len(values))
+        [iso.SetValue(number, value) for(number, value) in enumerate(values)]
+        probe.Update()
+        # the next Update allocates new arrays, so a shallow copy is enough.
+        surface = vtk.vtkPolyData()
+        surface.ShallowCopy(probe.GetOutput())
+        surface = crop_surface(surface, extent, image)
+        release_pages(data.GetOutput())
+        release_pages(gradient_magnitude.GetOutput())
+        if(surface.GetNumberOfCells()):
+            yield surface
+
+# surfaces of neighbouring bricks into one, merging the duplicated vertices
+# along their seams.
+def merge_surfaces(surfaces):
+    clean = vtk.vtkStaticCleanPolyData()
+    clean.SetInputData(append_surfaces(surfaces))
+    clean.Update()
+    return clean.GetOutput()
+
+def append_surfaces(surfaces):
+    append = vtk.vtkAppendPolyData()
+    # keeps the append valid when every brick was skipped.
+    append.AddInputData(vtk.vtkPolyData())
+    for surface in surfaces:
+        append.AddInputData(surface)
+    append.Update()
+    return append.GetOutput()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Clip-before-contour mode: the box kept by the axis clip planes becomes a
+volume of interest of the input image, so the voxels it clips away are never
+contoured. The clip stage still trims the surface to the exact planes.
+"""
+import math
+
+import vtk
+
+def add_clip_voi_argument(parser):
+    parser.add_argument('--clip-voi', dest='clip_voi', action='store_true',
+                        help='contour only the voxels inside the clip planes (moving a clip slider re-contours)')
+    return parser
+
+# index extent of image on the kept side of the axis-aligned planes, widened
+# to the cells the planes cut. Never empty, a plane past the volume leaves a
+# single slice, which has no cells to contour.
+def clip_extent(image, planes):
+    extent = list(image.GetExtent())
+    origin = image.GetOrigin()
+    spacing = image.GetSpacing()
+    for plane in planes:
+        normal = plane.GetNormal()
+        axis = max(range(3), key=lambda a: abs(normal[a]))
+        position = (plane.GetOrigin()[axis] - origin[axis]) / spacing[axis]
+        low, high = extent[2 * axis], extent[2 * axis + 1]
+        if(normal[axis] > 0):
+            extent[2 * axis] = min(max(low, math.floor(position)), high)
+        else:
+            extent[2 * axis + 1] = max(min(high, math.ceil(position)), low)
+    return tuple(extent)
+
+# overlap of two extents, None when they don't overlap.
+def intersect_extents(extent, other):
+    overlap = []
+    for axis in range(3):
+        low = max(extent[2 * axis], other[2 * axis])
+        high = min(extent[2 * axis + 1], other[2 * axis + 1])
+        if(low > high):
+            return None
+        overlap += [low, high]
+    return tuple(overlap)
+
+# surface of extract(region), region being the clip extent of data with
+# clip_voi and None otherwise. With clip_voi the surface is extracted again
+# whenever the planes move the clip extent.
+def generate_clip_region_source(extract, data, planes, clip_voi):
+    source = vtk.vtkProgrammableSource()
+    regions = [clip_extent(data.GetOutput(), planes) if clip_voi else None]
+
+    def execute():
+        source.GetPolyDataOutput().ShallowCopy(extract(regions[0]))
+    source.SetExecuteMethod(execute)
+
+    def follow_planes(obj, event):
+        region = clip_extent(data.GetOutput(), planes)
+        if(region != regions[0]):
+            regions[0] = region
+            source.Modified()
+    if(clip_voi):
+        for plane in planes:
+            plane.AddObserver("ModifiedEvent", follow_planes)
+    source.Update()
+    return source
+
+# VOI of data following the clip planes, the callbacks move the planes directly.
+def generate_clip_voi(data, planes):
+    voi = vtk.vtkExtractVOI()
+    voi.SetInputConnection(data.GetOutputPort())
+
+    def follow_planes(obj=None, event=None):
+        voi.SetVOI(*clip_extent(data.GetOutput(), planes))
+    for plane in planes:
+        plane.AddObserver("ModifiedEvent", follow_planes)
+    follow_planes()
+    return voi
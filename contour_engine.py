@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Isosurface extraction backends shared by isosurface, isogm, iso2dtf and
+isocomplete, selected with the --engine option.
+"""
+import os
+import vtk
+
+# contour        vtkContourFilter, the original backend.
+# marching-cubes classic vtkMarchingCubes.
+# flying-edges   vtkFlyingEdges3D on whatever SMP backend is active: the
+#                compiled-in default, or the threaded one once an smp filter
+#                has been created in the process.
+# smp            vtkFlyingEdges3D on the threaded SMP backend, all cores. The
+#                backend is process-wide and stays set.
+# auto           smp for image data on a multi-core node, flying-edges on a
+#                single core and contour for anything that isn't image data.
+engines = ["auto", "contour", "marching-cubes", "flying-edges", "smp"]
+
+# set once the threaded SMP backend has been initialized
+smp_threads = 0
+
+def add_engine_argument(parser):
+    parser.add_argument('--engine', dest='engine', choices=engines, default='auto',
+                        help='isosurface extraction backend')
+    return parser
+
+def is_image_data(data):
+    return isinstance(data.GetOutput(), vtk.vtkImageData)
+
+def resolve_engine(engine, data):
+    if(engine and engine != "auto"):
+        if(engine != "contour" and not is_image_data(data)):
+            # marching cubes and flying edges only take image data.
+            print('The ' + engine + ' engine needs image data, falling back to contour.')
+            return "contour"
+        return engine
+    if(not is_image_data(data)):
+        return "contour"
+    return "smp" if (os.cpu_count() or 1) > 1 else "flying-edges"
+
+# switches the whole process to the threaded backend, every vtkSMPTools
+# filter that runs afterwards uses it.
+def initialize_smp():
+    global smp_threads
+    if(not smp_threads):
+        # older VTK builds don't expose SetBackend, keep whatever was compiled in.
+        if(hasattr(vtk.vtkSMPTools, "SetBackend")):
+            vtk.vtkSMPTools.SetBackend("STDThread")
+        smp_threads = os.cpu_count() or 1
+        vtk.vtkSMPTools.Initialize(smp_threads)
+    return smp_threads
+
+def create_contour_filter(engine, data):
+    engine = resolve_engine(engine, data)
+    if(engine == "marching-cubes"):
+        iso = vtk.vtkMarchingCubes()
+    elif(engine in ("flying-edges", "smp")):
+        if(engine == "smp"):
+            initialize_smp()
+        iso = vtk.vtkFlyingEdges3D()
+        # carries the other point arrays of the input, like vtkContourFilter.
+        iso.InterpolateAttributesOn()
+    else:
+        iso = vtk.vtkContourFilter()
+    # every backend carries the isovalue as point scalars, like vtkContourFilter.
+    iso.ComputeScalarsOn()
+    iso.SetInputConnection(data.GetOutputPort())
+    return iso
+
+# whether the filters of engine interpolate the extra point arrays of data at
+# the contour vertices (marching cubes only outputs the isovalue).
+def interpolates_attributes(engine, data):
+    return resolve_engine(engine, data) != "marching-cubes"
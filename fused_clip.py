@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Single clip stage for the axis planes and the gradient window. The triangles
+are clipped against every half-space in one NumPy pass over the mesh, instead
+of by a chain of vtkClipPolyData each copying the whole mesh.
+"""
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+class FusedClip:
+    # planes keep the side their normal points to, like vtkClipPolyData with
+    # InsideOut off. gradient_range is the (min, max) window of the scalars.
+    def __init__(self, source, planes=(), gradient_range=None):
+        self.planes = list(planes)
+        self.gradient_range = gradient_range
+
+        self.clipper = vtk.vtkProgrammableFilter()
+        self.clipper.SetInputConnection(source.GetOutputPort())
+        self.clipper.SetExecuteMethod(self.clip)
+        # the callbacks move the planes directly.
+        for plane in self.planes:
+            plane.AddObserver("ModifiedEvent", lambda obj, event: self.clipper.Modified())
+
+    # signed distance functions of the table columns (>= 0 is kept), one per
+    # half-space.
+    def half_spaces(self, scalars_column):
+        spaces = []
+        for plane in self.planes:
+            origin = np.asarray(plane.GetOrigin())
+            normal = np.asarray(plane.GetNormal())
+            spaces.append(lambda table, origin=origin, normal=normal: (table[:, :3] - origin) @ normal)
+        if(self.gradient_range and scalars_column is not None):
+            low, high = self.gradient_range
+            spaces.append(lambda table: table[:, scalars_column] - low)
+            spaces.append(lambda table: high - table[:, scalars_column])
+        return spaces
+
+    def clip(self):
+        surface = self.clipper.GetPolyDataInput()
+        output = self.clipper.GetPolyDataOutput()
+        if(not surface.GetNumberOfCells()):
+            output.ShallowCopy(surface)
+            return
+        if(surface.GetNumberOfPolys() != surface.GetNumberOfCells()
+           or np.any(np.diff(numpy_support.vtk_to_numpy(surface.GetPolys().GetOffsetsArray())) != 3)):
+            # polygons and strips into triangles (the contours always are);
+            # vertices and lines have no side of a plane to keep.
+            surface = triangulate(surface)
+        polys = surface.GetPolys()
+
+        # points and every point array as the columns of one table, so the cut
+        # points interpolate all of them at once.
+        point_data = surface.GetPointData()
+        point_type = numpy_support.vtk_to_numpy(surface.GetPoints().GetData()).dtype
+        columns = [numpy_support.vtk_to_numpy(surface.GetPoints().GetData()).astype(np.float64)]
+        arrays = []
+        scalars_column = None
+        start = 3
+        for number in range(point_data.GetNumberOfArrays()):
+            array = point_data.GetArray(number)
+            if(array is None):
+                continue
+            values = numpy_support.vtk_to_numpy(array)
+            values = values.reshape(len(values), -1)
+            if(array is point_data.GetScalars()):
+                scalars_column = start
+            arrays.append((array, start, values.shape[1]))
+            columns.append(values.astype(np.float64))
+            start += values.shape[1]
+        table = np.hstack(columns)
+        triangles = numpy_support.vtk_to_numpy(polys.GetConnectivityArray()).reshape(-1, 3).astype(np.int64)
+        cells = np.arange(len(triangles))
+
+        for distance in self.half_spaces(scalars_column):
+            table, triangles, cells = clip_half_space(table, triangles, cells, distance(table))
+            if(not len(triangles)):
+                break
+
+        # only the points still referenced by a triangle
+        used, triangles = np.unique(triangles, return_inverse=True)
+        triangles = triangles.reshape(-1, 3)
+        table = table[used]
+
+        result = vtk.vtkPolyData()
+        points = vtk.vtkPoints()
+        points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(table[:, :3].astype(point_type)), deep=True))
+        result.SetPoints(points)
+        cell_array = vtk.vtkCellArray()
+        cell_array.SetData(numpy_support.numpy_to_vtkIdTypeArray(np.arange(0, 3 * len(triangles) + 1, 3, dtype=np.int64), deep=True),
+                           numpy_support.numpy_to_vtkIdTypeArray(np.ascontiguousarray(triangles.ravel(), dtype=np.int64), deep=True))
+        result.SetPolys(cell_array)
+        for array, start, width in arrays:
+            result.GetPointData().AddArray(table_array(array, table[:, start:start + width]))
+        if(point_data.GetScalars()):
+            result.GetPointData().SetActiveScalars(point_data.GetScalars().GetName())
+        if(point_data.GetNormals()):
+            result.GetPointData().SetActiveNormals(point_data.GetNormals().GetName())
+        cell_data = surface.GetCellData()
+        for number in range(cell_data.GetNumberOfArrays()):
+            array = cell_data.GetArray(number)
+            if(array is not None):
+                values = numpy_support.vtk_to_numpy(array)[cells]
+                result.GetCellData().AddArray(table_array(array, values.reshape(len(values), -1)))
+        output.ShallowCopy(result)
+
+    def GetOutputPort(self):
+        return self.clipper.GetOutputPort()
+
+    def GetOutput(self):
+        return self.clipper.GetOutput()
+
+    def Update(self):
+        self.clipper.Update()
+
+def triangulate(surface):
+    triangles = vtk.vtkTriangleFilter()
+    triangles.SetInputData(surface)
+    triangles.PassVertsOff()
+    triangles.PassLinesOff()
+    triangles.Update()
+    return triangles.GetOutput()
+
+# (count, components) values back into an array like array.
+def table_array(array, values):
+    dtype = numpy_support.vtk_to_numpy(array).dtype
+    if(np.issubdtype(dtype, np.integer)):
+        values = np.rint(values)
+    values = np.ascontiguousarray(values.astype(dtype))
+    copy = numpy_support.numpy_to_vtk(values if values.shape[1] > 1 else values[:, 0], deep=True, array_type=array.GetDataType())
+    copy.SetName(array.GetName())
+    return copy
+
+# clips the triangles against distance >= 0. Triangles with one vertex kept
+# become one triangle and those with two a quad split in two, like
+# vtkClipPolyData. The cut points are shared by the triangles of an edge.
+def clip_half_space(table, triangles, cells, distance):
+    inside = distance[triangles] >= 0
+    count = inside.sum(axis=1)
+    kept = count == 3
+
+    # rotate the lone kept (or clipped) vertex to the front, which keeps the
+    # winding of the triangles.
+    partial = (count == 1) | (count == 2)
+    tris = triangles[partial]
+    flags = inside[partial]
+    ones = count[partial] == 1
+    lone = np.where(ones, np.argmax(flags, axis=1), np.argmin(flags, axis=1))
+    tris = np.take_along_axis(tris, (lone[:, None] + np.arange(3)) % 3, axis=1)
+    partial_cells = cells[partial]
+
+    # one cut point per distinct mesh edge a-b and a-c
+    edges = np.sort(np.concatenate((tris[:, [0, 1]], tris[:, [0, 2]])), axis=1)
+    edges, edge_index = np.unique(edges, axis=0, return_inverse=True)
+    edge_index = edge_index.reshape(-1)
+    start, end = edges[:, 0], edges[:, 1]
+    t = distance[start] / (distance[start] - distance[end])
+    cut_ids = len(table) + np.arange(len(edges))
+    # cuts landing on a vertex reuse it instead of making degenerate triangles.
+    cut_ids = np.where(t <= 0, start, np.where(t >= 1, end, cut_ids))
+    table = np.vstack((table, table[start] + t[:, None] * (table[end] - table[start])))
+    ab = cut_ids[edge_index[:len(tris)]]
+    ac = cut_ids[edge_index[len(tris):]]
+
+    a, b, c = tris[:, 0], tris[:, 1], tris[:, 2]
+    quads = ~ones
+    triangles = np.concatenate((triangles[kept],
+                                np.stack((a, ab, ac), axis=1)[ones],
+                                np.stack((ab, b, c), axis=1)[quads],
+                                np.stack((ab, c, ac), axis=1)[quads]))
+    cells = np.concatenate((cells[kept], partial_cells[ones], partial_cells[quads], partial_cells[quads]))
+
+    # drop the triangles collapsed by cuts on a vertex
+    valid = ((triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2])
+             & (triangles[:, 0] != triangles[:, 2]))
+    return table, triangles[valid], cells[valid]
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Gradient magnitude computed from the loaded volume with central differences,
+in place of a separately read grad_file. The result is cached next to the
+data file as an uncompressed .grad.vti, rebuilt when the data file is newer.
+The gradient can also be attached to the data volume, so the contour filters
+interpolate it at the vertices instead of probing the gradient volume.
+"""
+import os
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from bricks import same_geometry
+from contour_engine import interpolates_attributes
+from mmap_reader import read_mapped, release_pages
+from span_index import scalars_as_array
+
+# z slices computed at once, so memory-mapped volumes never become fully resident.
+gradient_slab = 32
+
+gradient_array = "gradient_magnitude"
+
+def add_gradient_argument(parser):
+    parser.add_argument('--compute-gradient', dest='compute_gradient', action='store_true',
+                        help='compute the gradient magnitude from the data file instead of reading '
+                        'grad_file (also done when grad_file is omitted or "-")')
+    return parser
+
+# grad_file to read, or None when the gradient has to be computed.
+def gradient_file_argument(grad_file, compute_gradient):
+    return None if(compute_gradient or grad_file in (None, '-')) else grad_file
+
+def gradient_cache_file(file_name):
+    path, extension = os.path.splitext(file_name)
+    return path + '.grad.vti'
+
+# central differences along one axis. The edges are clamped, like
+# vtkImageGradientMagnitude with HandleBoundaries on.
+def central_difference(volume, axis, spacing):
+    padding = [(0, 0)] * volume.ndim
+    padding[axis] = (1, 1)
+    padded = np.pad(volume, padding, mode='edge')
+    count = volume.shape[axis]
+    return (np.take(padded, range(2, count + 2), axis=axis)
+            - np.take(padded, range(0, count), axis=axis)) * (0.5 / spacing)
+
+def gradient_magnitude_array(volume, spacing, slab=gradient_slab):
+    magnitude = np.empty(volume.shape, dtype=np.float32)
+    depth = volume.shape[0]
+    for start in range(0, depth, slab):
+        slices = np.arange(start, min(start + slab, depth))
+        block = volume[slices].astype(np.float32)
+        # z differences against the neighbouring slices, clamped at the ends.
+        squared = ((volume[np.minimum(slices + 1, depth - 1)].astype(np.float32)
+                    - volume[np.maximum(slices - 1, 0)]) * (0.5 / spacing[2])) ** 2
+        squared += central_difference(block, 1, spacing[1]) ** 2
+        squared += central_difference(block, 2, spacing[0]) ** 2
+        magnitude[slices] = np.sqrt(squared)
+    return magnitude
+
+def compute_gradient_magnitude(image):
+    magnitude = gradient_magnitude_array(scalars_as_array(image), image.GetSpacing())
+    release_pages(image)
+    array = numpy_support.numpy_to_vtk(magnitude.ravel(), deep=True)
+    array.SetName(gradient_array)
+    gradient = vtk.vtkImageData()
+    gradient.SetExtent(image.GetExtent())
+    gradient.SetSpacing(image.GetSpacing())
+    gradient.SetOrigin(image.GetOrigin())
+    gradient.GetPointData().SetScalars(array)
+    return gradient
+
+# raw appended data, so the cache can be memory-mapped with --mmap.
+def save_gradient(file_name, gradient):
+    writer = vtk.vtkXMLImageDataWriter()
+    writer.SetFileName(gradient_cache_file(file_name))
+    writer.SetInputData(gradient)
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    writer.SetCompressorTypeToNone()
+    if(not writer.Write()):
+        # read-only data directories just recompute next session.
+        print('Could not save the gradient magnitude to ' + writer.GetFileName())
+        return False
+    return True
+
+def read_cached_gradient(file_name, image, mapped=False):
+    cache_file = gradient_cache_file(file_name)
+    if(not os.path.exists(cache_file) or os.path.getmtime(cache_file) < os.path.getmtime(file_name)):
+        return None
+    reader = read_mapped(cache_file) if mapped else None
+    if(reader is None):
+        reader = vtk.vtkXMLImageDataReader()
+        reader.SetFileName(cache_file)
+        reader.Update()
+    gradient = reader.GetOutput()
+    if(gradient.GetExtent() != image.GetExtent() or gradient.GetSpacing() != image.GetSpacing()):
+        return None
+    return reader
+
+# gradient magnitude source of data (read from file_name), with the same
+# GetOutput/GetOutputPort interface as the readers.
+def load_gradient_magnitude(file_name, data, mapped=False):
+    image = data.GetOutput()
+    reader = read_cached_gradient(file_name, image, mapped) if file_name else None
+    if(reader):
+        return reader
+    gradient = compute_gradient_magnitude(image)
+    if(file_name and save_gradient(file_name, gradient) and mapped):
+        # map the cache back, so the computed copy doesn't stay resident.
+        reader = read_mapped(gradient_cache_file(file_name))
+        if(reader):
+            return reader
+    source = vtk.vtkPassThrough()
+    source.SetInputData(gradient)
+    source.Update()
+    return source
+
+# data with the gradient magnitude added as the gradient_array point array,
+# both volumes shallow copied. The contour filters interpolate it along the
+# edges they cut, so the vertices get their gradient without a probe.
+def attach_gradient(data, gradient_magnitude):
+    attach = vtk.vtkProgrammableFilter()
+    attach.SetInputConnection(data.GetOutputPort())
+    
+    def execute():
+        output = attach.GetOutput()
+        output.ShallowCopy(attach.GetInput())
+        gradient_magnitude.Update()
+        scalars = gradient_magnitude.GetOutput().GetPointData().GetScalars()
+        values = scalars.NewInstance()
+        values.ShallowCopy(scalars)
+        values.SetName(gradient_array)
+        output.GetPointData().AddArray(values)
+    attach.SetExecuteMethod(execute)
+    attach.Update()
+    return attach
+
+# whether contours of data can carry the gradient: the volumes share a grid
+# and the engine interpolates point arrays.
+def can_interpolate_gradient(engine, data, gradient_magnitude):
+    return (interpolates_attributes(engine, data)
+            and same_geometry(data.GetOutput(), gradient_magnitude.GetOutput()))
+
+# makes the interpolated gradient the active scalars of a contour of an
+# attach_gradient volume, for the gradient clippers and the mappers.
+def gradient_scalars(source):
+    assign = vtk.vtkAssignAttribute()
+    assign.SetInputConnection(source.GetOutputPort())
+    assign.Assign(gradient_array, vtk.vtkDataSetAttributes.SCALARS, vtk.vtkAssignAttribute.POINT_DATA)
+    return assign
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Event-to-frame latency of the slider widgets (--latency). Every Interaction
+and EndInteraction event of an observed widget is timestamped before its
+callbacks run, and its latency is the time until the render window finishes the frame
+showing it. Widgets whose results come from a worker thread are deferred: their
+events wait for a result to be shown rather than for the slider's own redraw.
+The p50/p95/p99 latencies per widget and the frame rate are shown in an
+on-screen text actor (--latency-hud) and appended to a log file
+(--latency-log) after every drag and at exit.
+"""
+import atexit
+import json
+import time
+from collections import deque
+
+import numpy as np
+import vtk
+
+# latencies and frame times kept per widget
+history_size = 1000
+# frames the frame rate is averaged over
+frame_window = 30
+# seconds between two HUD updates
+hud_interval = 0.25
+
+# the monitor of --latency, None when it is off
+active = None
+
+def add_latency_arguments(parser):
+    parser.add_argument('--latency', dest='latency', action='store_true',
+                        help='measure the event-to-frame latency of every slider')
+    parser.add_argument('--latency-hud', dest='latency_hud', action='store_true',
+                        help='show the latency percentiles and frame rate on screen')
+    parser.add_argument('--latency-log', dest='latency_log', default=None,
+                        help='append a JSON line per slider drag and at exit to this file')
+    return parser
+
+# None without --latency, otherwise where the latencies are reported.
+def latency_options(parser, args):
+    if(not args.latency):
+        if(args.latency_hud or args.latency_log):
+            parser.error('--latency-hud and --latency-log need --latency')
+        return None
+    return {'hud': args.latency_hud, 'log': args.latency_log}
+
+# p50/p95/p99 in milliseconds of latencies in seconds.
+def percentiles(latencies):
+    if(not latencies):
+        return None
+    return dict(zip(('p50', 'p95', 'p99'), (1000 * np.percentile(np.asarray(latencies), [50, 95, 99])).tolist()))
+
+class LatencyMonitor:
+    def __init__(self, hud=False, log=None):
+        self.log = log
+        # events waiting for their frame, by widget
+        self.pending = {}
+        # deferred events waiting for a result to be shown
+        self.waiting = {}
+        self.result = False
+        self.latencies = {}
+        # latencies of the drag in progress, by widget
+        self.drags = {}
+        # events coalesced into a later update, by widget
+        self.held = {}
+        # widgets released, logged once their last events have their frame
+        self.released = set()
+        # (name, deferred) of the observed widgets
+        self.widgets = {}
+        self.frames = deque(maxlen=frame_window)
+        self.hud = self.generate_hud() if hud else None
+        self.hud_time = 0.0
+
+    def generate_hud(self):
+        text = vtk.vtkTextActor()
+        text.GetTextProperty().SetFontSize(14)
+        text.GetTextProperty().SetFontFamilyToCourier()
+        text.GetTextProperty().SetVerticalJustificationToTop()
+        text.GetTextProperty().SetColor(1, 1, 1)
+        text.GetPositionCoordinate().SetCoordinateSystemToNormalizedDisplay()
+        text.GetPositionCoordinate().SetValue(0.02, 0.97)
+        return text
+
+    # times the Interaction and EndInteraction events of widget under name.
+    # The observers run before the widget's callbacks, so their work counts.
+    def observe(self, widget, name, deferred=False):
+        self.latencies.setdefault(name, deque(maxlen=history_size))
+        self.widgets[widget] = (name, deferred)
+        widget.AddObserver("InteractionEvent", lambda obj, event: self.event(name, deferred), 1.0)
+        widget.AddObserver("EndInteractionEvent", lambda obj, event: self.event(name, deferred, True), 1.0)
+
+    def event(self, name, deferred, release=False):
+        queue = self.waiting if deferred else self.pending
+        queue.setdefault(name, []).append(time.perf_counter())
+        if(release):
+            self.released.add(name)
+
+    # the last event of widget was coalesced, it waits for the update that applies it.
+    def hold(self, widget):
+        name, deferred = self.widgets[widget]
+        queue = self.waiting if deferred else self.pending
+        if(queue.get(name)):
+            self.held.setdefault(name, []).append(queue[name].pop())
+            if(not queue[name]):
+                del queue[name]
+
+    def release(self, widget):
+        name, deferred = self.widgets[widget]
+        queue = self.waiting if deferred else self.pending
+        if(name in self.held):
+            queue.setdefault(name, []).extend(self.held.pop(name))
+
+    # frames are counted when render_window finishes them, the HUD goes to renderer.
+    def observe_window(self, renderer, render_window):
+        if(self.hud):
+            renderer.AddViewProp(self.hud)
+        render_window.AddObserver("EndEvent", self.frame)
+
+    # a worker result is about to be shown, the deferred events get its frame.
+    def result_shown(self):
+        self.result = True
+
+    def frame(self, obj, event):
+        now = time.perf_counter()
+        self.frames.append(now)
+        if(self.result):
+            for name, times in self.waiting.items():
+                self.pending.setdefault(name, []).extend(times)
+            self.waiting = {}
+            self.result = False
+        for name, times in self.pending.items():
+            latencies = [now - start for start in times]
+            self.latencies[name].extend(latencies)
+            self.drags.setdefault(name, []).extend(latencies)
+        self.pending = {}
+        for name in [name for name in self.released if name not in self.waiting and name not in self.held]:
+            self.released.discard(name)
+            self.end_drag(name)
+        if(self.hud and now - self.hud_time > hud_interval):
+            self.hud_time = now
+            self.hud.SetInput(self.report())
+
+    def fps(self):
+        if(len(self.frames) < 2 or self.frames[-1] == self.frames[0]):
+            return 0.0
+        return (len(self.frames) - 1) / (self.frames[-1] - self.frames[0])
+
+    def summary(self, latencies=None):
+        latencies = self.latencies if latencies is None else latencies
+        return {name: dict(events=len(values), **percentiles(list(values)))
+                for name, values in latencies.items() if values}
+
+    def report(self):
+        lines = ['{:<14} {:>7} {:>7} {:>7}  ms'.format('', 'p50', 'p95', 'p99')]
+        for name, stats in self.summary().items():
+            lines.append('{:<14} {:>7.1f} {:>7.1f} {:>7.1f}'.format(name[:14], stats['p50'], stats['p95'], stats['p99']))
+        lines.append('{:.1f} fps'.format(self.fps()))
+        return '\n'.join(lines)
+
+    def write_log(self, kind, latencies):
+        if(not self.log):
+            return
+        entry = {'time': time.time(), 'kind': kind, 'fps': self.fps(), 'widgets': self.summary(latencies)}
+        with open(self.log, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+
+    # the drag of name is over: its latencies go to the log.
+    def end_drag(self, name):
+        drag = self.drags.pop(name, None)
+        if(drag):
+            self.write_log('drag', {name: drag})
+
+    def finish(self):
+        if(any(self.latencies.values())):
+            print(self.report())
+            self.write_log('session', None)
+
+# turns the monitor on for the options of latency_options, reporting at exit.
+def start_latency(options):
+    global active
+    if(options is None):
+        return None
+    active = LatencyMonitor(options['hud'], options['log'])
+    atexit.register(active.finish)
+    return active
+
+def observe_widget(widget, name, deferred=False):
+    if(active):
+        active.observe(widget, name, deferred)
+
+def observe_window(renderer, render_window):
+    if(active):
+        active.observe_window(renderer, render_window)
+
+def hold_event(widget):
+    if(active and widget in active.widgets):
+        active.hold(widget)
+
+def release_events(widget):
+    if(active and widget in active.widgets):
+        active.release(widget)
+
+def result_shown():
+    if(active):
+        active.result_shown()
@@ -5,13 +5,77 @@ Created on Sat Oct 12 11:40:01 2020
 @author: Jhon Corro
 @author: Cristhyan De Marchena
 """
+import numpy as np
 import vtk
+from vtk.util import numpy_support
+from mmap_reader import add_mmap_argument, mapped_extensions, read_mapped, scalar_range
+from contour_engine import add_engine_argument
+from span_index import RegionContour, contour_active_regions, load_span_index
+from surface_cache import SurfaceCache, add_cache_arguments
+from async_extract import BackgroundExtractor
+from contour_engine import create_contour_filter
+from gradient_volume import add_gradient_argument, attach_gradient, can_interpolate_gradient, gradient_file_argument, gradient_scalars, load_gradient_magnitude
+from fused_clip import FusedClip
+from batch_output import add_batch_arguments, batch_options, run_batch
+from clip_voi import add_clip_voi_argument, clip_extent
+from volume_pyramid import add_lod_arguments, build_pyramid, coarsest_level, observe_camera_interaction, pyramid_level, release_pyramid
+from time_series import TimeSeries, add_time_series_arguments, time_series_files, timestep_file
+from transfer_function import TransferFunction, TransferFunction2D
+from text_tables import load_table, region_dtype
+from interaction_latency import add_latency_arguments, latency_options, observe_widget, observe_window, result_shown, start_latency
+from slider_throttle import SliderThrottle, add_throttle_arguments, throttle_options
+from pipeline_profile import add_profile_arguments, profile_options, stage, start_profiling, watch, watch_actors, watch_pipeline
 
-# Countour filter
-iso = vtk.vtkContourFilter()
+# Countour stage, the isosurface contoured over the span index' active blocks
+iso = RegionContour()
+iso_data = None
+iso_engine = None
+span_index = None
+
+# Extracted isosurfaces by (file, isovalue, engine), fed to the pipeline through surface
+surface_cache = SurfaceCache()
+surface = vtk.vtkTrivialProducer()
+iso_file = None
+
+# Background extraction. The worker owns the pipeline from surface down to
+# clipper, the mapper shows its latest result through display.
+extractor = None
+display = vtk.vtkTrivialProducer()
+# slider state the worker applies to its pipeline, written by the callbacks
+requested = {'value': 0, 'x': 0, 'y': 0, 'z': 0, 'level': 0, 'time': 0}
+# isovalue and clip region currently held by surface
+surface_value = None
+surface_region = None
+probe = None
+gradient_data = None
+# data with the gradient attached by pyramid level source, when the contour filters
+# interpolate the gradient instead of probing it
+gradient_attached = None
+
+# Previews contoured and probed on a coarse level of the volume pyramids
+lod_iso = None
+
+# value x gradient transfer function, applied to the vertices of display's
+# output. The gradient window is its opacity, so the sliders only recolor.
+transfer_function = None
+# point array of the colors, and the field array of the isovalue of a result
+tf_color_array = "tf_rgba"
+isovalue_array = "isovalue"
+
+# Clip-before-contour: only the clip box of the volume is contoured
+clip_voi = False
+
+# Time series: files of the timesteps, their decoded volumes, gradients and
+# span indexes, and the timestep held by the worker's pipeline. The gradient
+# is a series of its own, one file for every timestep, or computed.
+series_files = None
+gradient_files = None
+static_gradient = None
+series = None
+timestep = 0
 
 global max, min, min_gradient, max_gradient, min_grad_clip_value 
-global max_grad_clip_value, min_grad_clipper, max_grad_clipper
+global max_grad_clip_value, clipper
 
 # planes
 xplane = vtk.vtkPlane()
@@ -31,41 +95,99 @@ white = 242/255
 def get_program_parameters():
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('data_file', nargs='?', default=None, help='data file')
-    parser.add_argument('grad_file', nargs='?', default=None, help='grad map file')
+    parser.add_argument('data_file', nargs='?', default=None,
+                        help='data file, or the timesteps as a glob pattern (quoted) or a .pvd')
+    parser.add_argument('grad_file', nargs='?', default=None,
+                        help='grad map file, or its timesteps ("-" computes it from the data file)')
     parser.add_argument('--val', dest='value', type=int, default=None, help='initial isovalue')
     parser.add_argument('--clip', dest='clip', nargs=3, type=int, default=None)
+    add_engine_argument(parser)
+    add_cache_arguments(parser)
+    add_lod_arguments(parser)
+    add_mmap_argument(parser)
+    add_clip_voi_argument(parser)
+    add_batch_arguments(parser)
+    add_gradient_argument(parser)
+    add_time_series_arguments(parser)
+    parser.add_argument('--tf', dest='tf_file', default=None,
+                        help='2D transfer function regions, "<min_value> <max_value> <min_grad> <max_grad> <r> <g> <b> <a>" per line')
+    add_profile_arguments(parser)
+    add_latency_arguments(parser)
+    add_throttle_arguments(parser)
     args = parser.parse_args()
+    batch = batch_options(parser, args)
     
-    return args.data_file, args.grad_file, args.value, args.clip
+    return args.data_file, gradient_file_argument(args.grad_file, args.compute_gradient), args.value, args.clip, args.engine, args.cache_mb, args.cache_dir, args.lod_levels, args.mmap, args.clip_voi, batch, args.prefetch, args.time_cache, args.tf_file, profile_options(parser, args), latency_options(parser, args), throttle_options(args)
 
-def read_file(file_name):
+def read_file(file_name, lod_levels=None, mapped=False):
     import os
+    reader = None
     if(file_name):
         path, extension = os.path.splitext(file_name)
         extension = extension.lower()
-        if extension == ".vti":
+        if(mapped and extension in mapped_extensions):
+            # zero-copy memory map, paged in as the filters touch it
+            reader = read_mapped(file_name)
+        if(reader is None and extension == ".vti"):
             reader = vtk.vtkXMLImageDataReader()
             reader.SetFileName(file_name)
             reader.Update()
-        else:
-            # the file provided doesn't match the accepted extenstions
-            reader = None
-    else:
-        reader = None
+        # reader stays None if the file provided doesn't match the accepted extenstions
+    if(reader):
+        build_pyramid(reader, lod_levels)
     return reader
 
-def generate_ctf(cmap):
-    ctf = vtk.vtkColorTransferFunction()
-    if(cmap):
-        [ctf.AddRGBPoint(value, rgb[0], rgb[1], rgb[2]) for(value, rgb) in cmap]
+# volume, gradient and span index of a timestep, read on the prefetch thread.
+def read_timestep(index, lod_levels=None, mapped=False):
+    data = read_file(series_files[index], lod_levels, mapped)
+    if(data is None):
+        raise ValueError(series_files[index] + ' is not a .vti file')
+    if(gradient_files):
+        gradient_magnitude = read_file(gradient_files[index], lod_levels, mapped)
+        if(gradient_magnitude is None):
+            raise ValueError(gradient_files[index] + ' is not a .vti file')
+    elif(static_gradient):
+        gradient_magnitude = static_gradient
     else:
-        ctf.AddRGBPoint(min_gradient, 31/255, 162/255, 255/255)
-        ctf.AddRGBPoint(max_gradient/4, 163/255, 99/255, 235/255)
-        ctf.AddRGBPoint(max_gradient/2, 255/255, 102/255, 102/255)
-        ctf.AddRGBPoint(max_gradient *3/4, 235/255, 183/255, 113/255)
-        ctf.AddRGBPoint(max_gradient, 255/255, 251/255, 19/255)
-    return ctf    
+        gradient_magnitude = load_gradient_magnitude(series_files[index], data, mapped)
+        build_pyramid(gradient_magnitude, lod_levels)
+    return data, gradient_magnitude, load_span_index(series_files[index], data.GetOutput())
+
+def release_timestep(volume):
+    data, gradient_magnitude, index = volume
+    release_pyramid(data)
+    if(gradient_magnitude is not static_gradient):
+        release_pyramid(gradient_magnitude)
+
+# points the pipeline at timestep index, the surface has to be contoured again.
+def set_timestep(index):
+    global iso_data, gradient_data, span_index, iso_file, timestep, surface_value, gradient_attached
+    iso_data, gradient_data, span_index = series.get(index)
+    iso_file = series_files[index]
+    timestep = index
+    if(gradient_attached is not None):
+        gradient_attached = {}
+    elif(probe):
+        # the vertices are probed in this timestep's gradient
+        probe.SetSourceConnection(gradient_data.GetOutputPort())
+    surface_value = None
+
+# gradient colors of every value, with the regions of tf_file painted over them.
+def generate_transfer_function(tf_file=None):
+    colors = TransferFunction.from_rgb([min_gradient, max_gradient/4, max_gradient/2, max_gradient *3/4, max_gradient],
+                                       [[31/255, 162/255, 255/255],
+                                        [163/255, 99/255, 235/255],
+                                        [255/255, 102/255, 102/255],
+                                        [235/255, 183/255, 113/255],
+                                        [255/255, 251/255, 19/255]])
+    tf = TransferFunction2D((min, max), (min_gradient, max_gradient), colors)
+    if(tf_file):
+        regions = load_table(tf_file, region_dtype)
+        regions['rgba'][:, :3] /= 255
+        for region in regions:
+            tf.add_region(region['value'], region['gradient'], region['rgba'])
+    tf.set_gradient_window(min_grad_clip_value, max_grad_clip_value)
+    return tf
     
     
 def generate_plane_origins(clip):
@@ -87,6 +209,10 @@ def generate_plane_origins(clip):
             origins.InsertPoint(2, [0, 0, clip[2]]) # z
         else:
             origins.InsertPoint(2, [0, 0, 0]) # z
+    else:
+        # SetNumberOfPoints leaves them uninitialized
+        for index in range(3):
+            origins.InsertPoint(index, [0, 0, 0])
     return origins
 
 def generate_plane_normals():
@@ -99,19 +225,24 @@ def generate_plane_normals():
     normals.SetTuple(2, [0, 0, 1])
     return normals
     
-def generate_actors(data, gradient_magnitude, val, clip):    
+def generate_actors(data, gradient_magnitude, val, clip, engine, tf_file=None):    
     # contour
-    global iso
-    iso.SetInputConnection(data.GetOutputPort())
-    if(val):
-        iso.SetValue(0, val)    
+    global iso_data, iso_engine, lod_iso, probe, gradient_data, gradient_attached
+    iso_data = data
+    iso_engine = engine
+    gradient_data = gradient_magnitude
+    if(can_interpolate_gradient(engine, data, gradient_magnitude)):
+        gradient_attached = {}
+    lod_iso = watch(create_contour_filter(engine, contour_source(coarsest_level(data))), 'contour (coarse)')
+    
+    if(gradient_attached is not None):
+        # gradient interpolated along the edges the contour cut
+        probe = gradient_scalars(surface)
     else:
-        iso.SetValue(0, max/4)
-    
-    #probe
-    probe = vtk.vtkProbeFilter()
-    probe.SetInputConnection(iso.GetOutputPort())
-    probe.SetSourceConnection(gradient_magnitude.GetOutputPort())
+        #probe
+        probe = vtk.vtkProbeFilter()
+        probe.SetInputConnection(surface.GetOutputPort())
+        probe.SetSourceConnection(gradient_magnitude.GetOutputPort())
 
     # generate vtkPlanes stuff.
     origins = generate_plane_origins(clip)
@@ -125,38 +256,30 @@ def generate_actors(data, gradient_magnitude, val, clip):
     planes.GetPlane(1, yplane)
     planes.GetPlane(2, zplane)
     
-    xclipper = vtk.vtkClipPolyData()
-    xclipper.SetInputConnection(probe.GetOutputPort())
-    xclipper.SetClipFunction(xplane)
-    
-    yclipper = vtk.vtkClipPolyData()
-    yclipper.SetInputConnection(xclipper.GetOutputPort())
-    yclipper.SetClipFunction(yplane)
-    
-    zclipper = vtk.vtkClipPolyData()
-    zclipper.SetInputConnection(yclipper.GetOutputPort())
-    zclipper.SetClipFunction(zplane)
-    
+    # after the planes, clip-before-contour needs the clip box
+    if(val):
+        update_isosurface(val)
+    else:
+        update_isosurface(max/4)
     
-    global min_grad_clipper, max_grad_clipper, min_grad_clip_value, max_grad_clip_value
-    min_grad_clipper = vtk.vtkClipPolyData()
-    min_grad_clipper.SetInputConnection(zclipper.GetOutputPort())
-    min_grad_clipper.InsideOutOff()
-    min_grad_clipper.SetValue(min_grad_clip_value)
-    min_grad_clipper.Update()
-
-    max_grad_clipper = vtk.vtkClipPolyData()
-    max_grad_clipper.SetInputConnection(min_grad_clipper.GetOutputPort())
-    max_grad_clipper.InsideOutOn()
-    max_grad_clipper.SetValue(max_grad_clip_value)
-    max_grad_clipper.Update()
+    # the three planes in a single clip pass, the gradient window is left to
+    # the transfer function
+    global clipper, transfer_function
+    clipper = FusedClip(probe, [xplane, yplane, zplane])
+    watch_pipeline(clipper.clipper, 'FusedClip (planes)')
+    clipper.Update()
+    transfer_function = generate_transfer_function(tf_file)
     
-    ctf = generate_ctf(None)
+    requested.update(value=surface_value,
+                     x=xplane.GetOrigin()[0], y=yplane.GetOrigin()[1], z=zplane.GetOrigin()[2])
+    show(snapshot_extraction(surface_value))
     
     clipMapper = vtk.vtkDataSetMapper()
-    clipMapper.SetLookupTable(ctf)
-    clipMapper.SetInputConnection(max_grad_clipper.GetOutputPort())
-    clipMapper.SetScalarRange(0, 255)
+    clipMapper.SetInputConnection(display.GetOutputPort())
+    # the transfer function colors, alpha included
+    clipMapper.SetColorModeToDirectScalars()
+    clipMapper.SetScalarModeToUsePointFieldData()
+    clipMapper.SelectColorArray(tf_color_array)
 
     
     # Generate iso surface actor from iso surface mapper.
@@ -199,11 +322,155 @@ def generate_iso_slide_bar(value):
     slide_bar.GetPoint2Coordinate().SetValue(0.98 , 0.1)
     return slide_bar
 
+# volume contoured at a pyramid level: the data itself, or the data with the
+# gradient of the same level attached.
+def contour_source(level=0):
+    source = pyramid_level(iso_data, level)
+    if(gradient_attached is None):
+        return source
+    if(source not in gradient_attached):
+        gradient_attached[source] = attach_gradient(source, pyramid_level(gradient_data, level))
+    return gradient_attached[source]
+
+# extent of the clip box in clip-before-contour mode, None otherwise.
+def clip_region():
+    return clip_extent(iso_data.GetOutput(), [xplane, yplane, zplane]) if(clip_voi) else None
+
+def update_isosurface(value):
+    global surface_value, surface_region
+    region = clip_region()
+    key = surface_cache.key(iso_file, value, iso_engine, region)
+    cached = surface_cache.get(key)
+    if(cached is None):
+        # only the blocks straddling value get contoured.
+        with stage('contour (span index)'):
+            cached = surface_cache.put(key, contour_active_regions(iso, contour_source(), span_index, key[1], iso_engine, region))
+    surface.SetOutput(cached)
+    surface_value = value
+    surface_region = region
+
+# copy of the clipped surface contoured at value, for the main thread.
+def snapshot_extraction(value):
+    clipper.Update()
+    result = vtk.vtkPolyData()
+    result.DeepCopy(clipper.GetOutput())
+    isovalue = vtk.vtkDoubleArray()
+    isovalue.SetName(isovalue_array)
+    isovalue.InsertNextValue(value)
+    result.GetFieldData().AddArray(isovalue)
+    return result
+
+# colors every vertex of surface through the 2D transfer function, from its
+# isovalue and gradient, in one vectorized lookup.
+def apply_transfer_function(surface):
+    gradients = surface.GetPointData().GetScalars()
+    if(gradients is None):
+        return surface
+    value = surface.GetFieldData().GetArray(isovalue_array).GetValue(0)
+    gradients = numpy_support.vtk_to_numpy(gradients)
+    colors = transfer_function.lookup(np.full(len(gradients), value), gradients)
+    array = numpy_support.numpy_to_vtk(np.rint(colors * 255).astype(np.uint8), deep=True)
+    array.SetName(tf_color_array)
+    surface.GetPointData().AddArray(array)
+    surface.Modified()
+    return surface
+
+def show(result):
+    with stage('transfer function'):
+        display.SetOutput(apply_transfer_function(result))
+
+# runs on the worker thread. Requests at a pyramid level (the user is still
+# interacting) only get that level. Level 0 requests get a coarse preview when
+# the isovalue has to be contoured, then the full resolution mesh.
+def extract_request(request, token):
+    global surface_value
+    if(series and request['time'] != timestep):
+        set_timestep(request['time'])
+    xplane.SetOrigin(request['x'], 0, 0)
+    yplane.SetOrigin(0, request['y'], 0)
+    zplane.SetOrigin(0, 0, request['z'])
+    value = request['value']
+    # pyramid_level clamps levels past the coarsest one
+    level = request['level'] if(coarsest_level(iso_data)) else 0
+    stale = value != surface_value or clip_region() != surface_region
+    if(not level and stale
+       and surface_cache.key(iso_file, value, iso_engine, clip_region()) not in surface_cache):
+        level = coarsest_level(iso_data)
+        refine = True
+    else:
+        refine = not level
+    if(level):
+        lod_iso.SetInputConnection(contour_source(level).GetOutputPort())
+        lod_iso.SetValue(0, value)
+        lod_iso.Update()
+        surface.SetOutput(lod_iso.GetOutput())
+        surface_value = None
+        if(gradient_attached is None):
+            probe.SetSourceConnection(pyramid_level(gradient_data, level).GetOutputPort())
+        yield snapshot_extraction(value)
+        if(not refine or token.cancelled):
+            return
+    if(gradient_attached is None):
+        probe.SetSourceConnection(gradient_data.GetOutputPort())
+    if(value != surface_value or clip_region() != surface_region):
+        update_isosurface(value)
+    yield snapshot_extraction(value)
+
+def request_update(**changes):
+    requested.update(changes)
+    if(extractor):
+        extractor.submit(dict(requested))
+
+# swaps in the worker's latest result, polled from an interactor timer.
+def extraction_timer_callback(obj, event):
+    result = extractor.poll()
+    if(result):
+        show(result)
+        result_shown()
+        obj.GetRenderWindow().Render()
+
 def custom_iso_callback(obj, event):
     value = int (obj.GetRepresentation().GetValue())
-    global iso
-    iso.SetValue(0, value)
-    iso.Update()
+    request_update(value=value, level=coarsest_level(iso_data))
+
+# the full resolution pipeline runs once a slider or the camera goes idle.
+def interaction_end_callback(obj, event):
+    request_update(level=0)
+
+def camera_start_callback(obj, event):
+    request_update(level=coarsest_level(iso_data))
+
+def generate_time_slide_bar():
+    # Create Slidebar
+    slide_bar = vtk.vtkSliderRepresentation2D()
+    
+    # Set range and title.
+    slide_bar.SetMinimumValue(0)
+    slide_bar.SetMaximumValue(len(series_files) - 1)
+    slide_bar.SetValue(timestep)
+    slide_bar.SetLabelFormat("%0.0f")
+    slide_bar.SetTitleText("Time step")
+    
+    # Set colors.
+    slide_bar = set_slide_bar_colors(slide_bar)
+    
+    # Set coordinates.
+    slide_bar.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
+    slide_bar.GetPoint1Coordinate().SetValue(0.78, 0.7)
+    
+    slide_bar.GetPoint2Coordinate().SetCoordinateSystemToNormalizedDisplay()
+    slide_bar.GetPoint2Coordinate().SetValue(0.98 , 0.7)
+    return slide_bar
+
+# coarse while the slider moves, the next timesteps are already being read.
+def custom_time_callback(obj, event):
+    index = int(round(obj.GetRepresentation().GetValue()))
+    request_update(time=index, level=coarsest_level(iso_data))
+
+def custom_time_end_callback(obj, event):
+    index = int(round(obj.GetRepresentation().GetValue()))
+    obj.GetRepresentation().SetValue(index)
+    request_update(time=index, level=0)
 
 def generate_min_grad_slide_bar():
     # Create Slidebar
@@ -227,10 +494,17 @@ def generate_min_grad_slide_bar():
     slide_bar.GetPoint2Coordinate().SetValue(0.98 , 0.3)
     return slide_bar
 
+# the window only changes the colors of the surface on display.
+def set_gradient_window(interactor, low, high):
+    global min_grad_clip_value, max_grad_clip_value
+    min_grad_clip_value, max_grad_clip_value = low, high
+    transfer_function.set_gradient_window(low, high)
+    apply_transfer_function(display.GetOutputDataObject(0))
+    interactor.GetRenderWindow().Render()
+
 def custom_min_grad_callback(obj, event):
     value = int (obj.GetRepresentation().GetValue())
-    global min_grad_clipper
-    min_grad_clipper.SetValue(value)
+    set_gradient_window(obj.GetInteractor(), value, max_grad_clip_value)
     
 def generate_max_grad_slide_bar():
     # Create Slidebar
@@ -257,8 +531,7 @@ def generate_max_grad_slide_bar():
 
 def custom_max_grad_callback(obj, event):
     value = int (obj.GetRepresentation().GetValue())
-    global max_grad_clipper
-    max_grad_clipper.SetValue(value)
+    set_gradient_window(obj.GetInteractor(), min_grad_clip_value, value)
 
 def generate_x_axis_slide_bar(max, value):
     # Create Slidebar
@@ -288,8 +561,7 @@ def generate_x_axis_slide_bar(max, value):
 
 def x_axis_custom_callback(obj, event):
     value = int (obj.GetRepresentation().GetValue())
-    global xplane
-    xplane.SetOrigin(value, 0, 0)
+    request_update(x=value, level=coarsest_level(iso_data))
 
 def generate_y_axis_slide_bar(max, value):
     # Create Slidebar
@@ -318,8 +590,7 @@ def generate_y_axis_slide_bar(max, value):
 
 def y_axis_custom_callback(obj, event):
     value = int (obj.GetRepresentation().GetValue())
-    global yplane
-    yplane.SetOrigin(0, value, 0)
+    request_update(y=value, level=coarsest_level(iso_data))
 
 def generate_z_axis_slide_bar(max, value):
     # Create Slidebar
@@ -347,10 +618,9 @@ def generate_z_axis_slide_bar(max, value):
 
 def z_axis_custom_callback(obj, event):
     value = int (obj.GetRepresentation().GetValue())
-    global zplane
-    zplane.SetOrigin(0, 0, value)
+    request_update(z=value, level=coarsest_level(iso_data))
 
-def generate_gui(actors, val, clip):
+def generate_gui(actors, val, clip, throttle):
     actorBounds = actors[0].GetBounds()
     maxX = int(actorBounds[1] + 1)
     maxY = int(actorBounds[3] + 1)
@@ -362,21 +632,46 @@ def generate_gui(actors, val, clip):
     renderer_window.AddRenderer(renderer)
     renderer_window_interactor = vtk.vtkRenderWindowInteractor()
     renderer_window_interactor.SetRenderWindow(renderer_window)
+    # the sliders update the pipeline at a bounded rate
+    sliders = SliderThrottle(renderer_window_interactor, throttle['interval'], throttle['debounce'])
+    
+    # the transfer function opacity needs sorted transparency
+    renderer_window.SetAlphaBitPlanes(1)
+    renderer_window.SetMultiSamples(0)
+    renderer.SetUseDepthPeeling(1)
+    renderer.SetMaximumNumberOfPeels(100)
+    renderer.SetOcclusionRatio(0.1)
+    
+    # Extraction runs in the background, results are picked up by a timer
+    global extractor
+    extractor = BackgroundExtractor(extract_request)
+    renderer_window_interactor.AddObserver("TimerEvent", extraction_timer_callback)
     
     # Add iso slide bar   
     iso_slide_bar = generate_iso_slide_bar(val)
     iso_slider_widget = vtk.vtkSliderWidget()
     iso_slider_widget.SetInteractor(renderer_window_interactor)
     iso_slider_widget.SetRepresentation(iso_slide_bar)
-    iso_slider_widget.AddObserver("InteractionEvent", custom_iso_callback)
+    sliders.observe(iso_slider_widget, custom_iso_callback, interaction_end_callback)
+    observe_widget(iso_slider_widget, 'isovalue', deferred=True)
     iso_slider_widget.EnabledOn()
     
+    # Add time slide bar
+    if(series):
+        time_slider_widget = vtk.vtkSliderWidget()
+        time_slider_widget.SetInteractor(renderer_window_interactor)
+        time_slider_widget.SetRepresentation(generate_time_slide_bar())
+        sliders.observe(time_slider_widget, custom_time_callback, custom_time_end_callback)
+        observe_widget(time_slider_widget, 'time', deferred=True)
+        time_slider_widget.EnabledOn()
+    
     # Add min grad slide bar   
     min_grad_slide_bar = generate_min_grad_slide_bar()
     min_grad_slider_widget = vtk.vtkSliderWidget()
     min_grad_slider_widget.SetInteractor(renderer_window_interactor)
     min_grad_slider_widget.SetRepresentation(min_grad_slide_bar)
-    min_grad_slider_widget.AddObserver("InteractionEvent", custom_min_grad_callback)
+    sliders.observe(min_grad_slider_widget, custom_min_grad_callback)
+    observe_widget(min_grad_slider_widget, 'min gradient')
     min_grad_slider_widget.EnabledOn()
     
     # Add max grad slide bar   
@@ -384,7 +679,8 @@ def generate_gui(actors, val, clip):
     max_grad_slider_widget = vtk.vtkSliderWidget()
     max_grad_slider_widget.SetInteractor(renderer_window_interactor)
     max_grad_slider_widget.SetRepresentation(max_grad_slide_bar)
-    max_grad_slider_widget.AddObserver("InteractionEvent", custom_max_grad_callback)
+    sliders.observe(max_grad_slider_widget, custom_max_grad_callback)
+    observe_widget(max_grad_slider_widget, 'max gradient')
     max_grad_slider_widget.EnabledOn()
     
     # Add x-axis slide bar   
@@ -392,7 +688,8 @@ def generate_gui(actors, val, clip):
     x_axis_slider_widget = vtk.vtkSliderWidget()
     x_axis_slider_widget.SetInteractor(renderer_window_interactor)
     x_axis_slider_widget.SetRepresentation(x_axis_slide_bar)
-    x_axis_slider_widget.AddObserver("InteractionEvent", x_axis_custom_callback)
+    sliders.observe(x_axis_slider_widget, x_axis_custom_callback, interaction_end_callback)
+    observe_widget(x_axis_slider_widget, 'x clip', deferred=True)
     x_axis_slider_widget.EnabledOn()
     
     
@@ -401,7 +698,8 @@ def generate_gui(actors, val, clip):
     y_axis_slider_widget = vtk.vtkSliderWidget()
     y_axis_slider_widget.SetInteractor(renderer_window_interactor)
     y_axis_slider_widget.SetRepresentation(y_axis_slide_bar)
-    y_axis_slider_widget.AddObserver("InteractionEvent", y_axis_custom_callback)
+    sliders.observe(y_axis_slider_widget, y_axis_custom_callback, interaction_end_callback)
+    observe_widget(y_axis_slider_widget, 'y clip', deferred=True)
     y_axis_slider_widget.EnabledOn()
     
     
@@ -410,17 +708,16 @@ def generate_gui(actors, val, clip):
     z_axis_slider_widget = vtk.vtkSliderWidget()
     z_axis_slider_widget.SetInteractor(renderer_window_interactor)
     z_axis_slider_widget.SetRepresentation(z_axis_slide_bar)
-    z_axis_slider_widget.AddObserver("InteractionEvent", z_axis_custom_callback)
+    sliders.observe(z_axis_slider_widget, z_axis_custom_callback, interaction_end_callback)
+    observe_widget(z_axis_slider_widget, 'z clip', deferred=True)
     z_axis_slider_widget.EnabledOn()
     
-    ctf = generate_ctf(None)
-    
     scalar_bar = vtk.vtkScalarBarActor()
     scalar_bar.SetOrientationToHorizontal()
     scalar_bar.SetTextPositionToPrecedeScalarBar()
     scalar_bar.UnconstrainedFontSizeOff()
-    # Pops CTF from the actors' list
-    scalar_bar.SetLookupTable(ctf)
+    # the gradient colors of the transfer function
+    scalar_bar.SetLookupTable(transfer_function.colors.lookup_table())
     scalar_bar.SetNumberOfLabels(5)
     scalar_bar.SetLabelFormat("%-6.0f")
     
@@ -445,15 +742,21 @@ def generate_gui(actors, val, clip):
     
     # Smoother camera controls
     renderer_window_interactor.GetInteractorStyle().SetCurrentStyleToTrackballCamera();
+    # coarse level while the camera moves
+    observe_camera_interaction(renderer_window_interactor, camera_start_callback, interaction_end_callback)
+    # event-to-frame latency of the sliders
+    observe_window(renderer, renderer_window)
     renderer_window_interactor.Initialize()
     renderer_window.Render()
     renderer_window.SetWindowName('Iso2DTF')
     renderer_window.Render()
+    renderer_window_interactor.CreateRepeatingTimer(30)
     renderer_window_interactor.Start()
+    extractor.stop()
     
 
 def update_max_min_from_data(data, is_gradient_magnitude):
-    _min, _max = data.GetOutput().GetScalarRange()
+    _min, _max = scalar_range(data.GetOutput())
     if(is_gradient_magnitude):
         global min_gradient
         global max_gradient
@@ -471,20 +774,71 @@ def update_max_min_from_data(data, is_gradient_magnitude):
 
 def main():
     # Get file paths from cli params.
-    data_file, grad_file, val, clip = get_program_parameters()
+    data_file, grad_file, val, clip, engine, cache_mb, cache_dir, lod_levels, mapped, voi, batch, prefetch, time_cache, tf_file, profile, latency, throttle = get_program_parameters()
+    start_profiling(profile)
+    start_latency(latency)
+    
+    global series_files, gradient_files, static_gradient, series
+    series_files = time_series_files(data_file)
+    if(series_files is not None):
+        data_file = series_files[0] if(series_files) else None
+        gradient_files = time_series_files(grad_file)
+        if(gradient_files is not None):
+            if(len(gradient_files) != len(series_files)):
+                print('The gradient files ({}) do not match the timesteps ({}).'.format(len(gradient_files), len(series_files)))
+                return
+            grad_file = gradient_files[0]
     
     # Read data file.
-    data = read_file(data_file)
-    gradient_magnitude = read_file(grad_file)
+    with stage('read'):
+        data = read_file(data_file, lod_levels, mapped=mapped)
+    with stage('gradient'):
+        if(grad_file):
+            gradient_magnitude = read_file(grad_file, lod_levels, mapped=mapped)
+        elif(data):
+            # central differences of the loaded volume, cached next to data_file
+            gradient_magnitude = load_gradient_magnitude(data_file, data, mapped)
+            build_pyramid(gradient_magnitude, lod_levels)
+        else:
+            gradient_magnitude = None
     
     # update min and max
     update_max_min_from_data(data, False)
     update_max_min_from_data(gradient_magnitude, True)
+    if(series_files and grad_file and not gradient_files):
+        # a single gradient file serves every timestep
+        static_gradient = gradient_magnitude
     
     if(data):
-        actors = generate_actors(data, gradient_magnitude, val, clip)
-        # Generate GUI
-        generate_gui(actors, val, clip)        
+        global span_index, surface_cache, iso_file, clip_voi
+        clip_voi = voi
+        with stage('span index'):
+            span_index = load_span_index(data_file, data.GetOutput())
+        surface_cache = SurfaceCache(cache_mb, cache_dir)
+        iso_file = data_file
+        if(series_files):
+            series = TimeSeries(len(series_files), lambda index: read_timestep(index, lod_levels, mapped),
+                                prefetch, time_cache, release_timestep)
+            series.store(0, (data, gradient_magnitude, span_index))
+            series.schedule(0)
+        with stage('generate_actors'):
+            actors = generate_actors(data, gradient_magnitude, val, clip, engine, tf_file)
+        watch_actors(actors)
+        if(batch and series):
+            # headless: every timestep, numbered
+            for index in range(len(series_files)):
+                set_timestep(index)
+                update_isosurface(requested['value'])
+                show(snapshot_extraction(requested['value']))
+                run_batch(actors, {'output': batch['output'] and timestep_file(batch['output'], index),
+                                   'screenshot': batch['screenshot'] and timestep_file(batch['screenshot'], index),
+                                   'size': batch['size']}, zoom=0.5)
+        elif(batch):
+            # headless: write the meshes and/or the render, then exit
+            run_batch(actors, batch, zoom=0.5)
+        else:
+            # Generate GUI
+            generate_gui(actors, val, clip, throttle)        
     else:
         print('The data file was not found or the file provided does not match neither the .vti and .vtp extension.')
     
@@ -5,13 +5,32 @@ Created on Sat Oct 12 11:40:01 2020
 @author: Jhon Corro
 @author: Cristhyan De Marchena
 """
+import numpy as np
 import vtk
+from vtk.util import numpy_support
+from mmap_reader import add_mmap_argument, mapped_extensions, read_mapped
+from contour_engine import add_engine_argument, create_contour_filter
+from bricks import add_brick_argument
+from span_index import load_span_index
+from gradient_volume import add_gradient_argument, attach_gradient, can_interpolate_gradient, gradient_file_argument, gradient_scalars, load_gradient_magnitude
+from fused_clip import FusedClip
+from batch_output import add_batch_arguments, batch_options, run_batch
+from clip_voi import add_clip_voi_argument, generate_clip_region_source, generate_clip_voi
+from parallel_extract import add_workers_argument, extract_parallel, parallel_brick_size
+from bricks import append_surfaces, extract_cells
+from text_tables import add_table_cache_argument, load_table, params_dtype
+from interaction_latency import add_latency_arguments, latency_options, observe_widget, observe_window, start_latency
+from slider_throttle import SliderThrottle, add_throttle_arguments, throttle_options
+from pipeline_profile import add_profile_arguments, profile_options, stage, start_profiling, watch_actors, watch_pipeline
 
 # planes
 xplane = vtk.vtkPlane()
 yplane = vtk.vtkPlane()
 zplane = vtk.vtkPlane()
 
+# name of the point array holding the isovalue of each contour vertex
+contour_value_array = "contour_value"
+
 
 # SLIDE BAR COLORS
 red_r = 224/255
@@ -26,49 +45,48 @@ def get_program_parameters():
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('data_file', nargs='?', default=None, help='data file')
-    parser.add_argument('grad_file', nargs='?', default=None, help='grad map file')
+    parser.add_argument('grad_file', nargs='?', default=None, help='grad map file ("-" computes it from the data file)')
     parser.add_argument('params_file', nargs='?', default=None, help='grad map file')
     parser.add_argument('--clip', dest='clip', nargs=3, type=int, default=None)
+    add_engine_argument(parser)
+    add_mmap_argument(parser)
+    add_clip_voi_argument(parser)
+    add_batch_arguments(parser)
+    add_gradient_argument(parser)
+    add_brick_argument(parser)
+    add_workers_argument(parser)
+    add_table_cache_argument(parser)
+    add_profile_arguments(parser)
+    add_latency_arguments(parser)
+    add_throttle_arguments(parser)
     args = parser.parse_args()
+    batch = batch_options(parser, args)
     
-    return args.data_file, args.grad_file, args.params_file, args.clip
+    return args.data_file, gradient_file_argument(args.grad_file, args.compute_gradient), args.params_file, args.clip, args.engine, args.mmap, args.brick_size, args.workers, args.clip_voi, batch, args.cache_tables, profile_options(parser, args), latency_options(parser, args), throttle_options(args)
 
-def read_file(file_name):
+def read_file(file_name, mapped=False):
     import os
+    reader = None
     if(file_name):
         path, extension = os.path.splitext(file_name)
         extension = extension.lower()
-        if extension == ".vti":
+        if(mapped and extension in mapped_extensions):
+            # zero-copy memory map, paged in as the filters touch it
+            reader = read_mapped(file_name)
+        if(reader is None and extension == ".vti"):
             reader = vtk.vtkXMLImageDataReader()
             reader.SetFileName(file_name)
             reader.Update()
-        else:
-            # the file provided doesn't match the accepted extenstions
-            reader = None
-    else:
-        reader = None
+        # reader stays None if the file provided doesn't match the accepted extenstions
     return reader
 
-# list of <value> <min_grad> <max_grad> <r> <g> <b> <a>, separated by and space.
-def read_params(file_name):
-    values = list()
-    with open(file_name) as file:
-        line = file.readline()
-        while line:
-            if not line.startswith("#"):
-                arr = line.split(" ")
-                grad = [int(arr[1]), int(arr[2])]
-                rgba = [int(arr[3])/255, int(arr[4])/255, int(arr[5])/255, float(arr[6])]                
-                values.append([int(arr[0]), grad, rgba])
-            line = file.readline()
-    return values
+# (value, gradient, rgba) rows of <value> <min_grad> <max_grad> <r> <g> <b> <a>,
+# rgb in 0..255 scaled to 0..1.
+def read_params(file_name, cache=False):
+    params = load_table(file_name, params_dtype, cache)
+    params['rgba'][:, :3] /= 255
+    return params
 
-def generate_ctf(min, max, r, g, b):
-    ctf = vtk.vtkColorTransferFunction()
-    ctf.AddRGBPoint(min, r, g, b)
-    ctf.AddRGBPoint(max, r, g, b)
-    return ctf    
-    
     
 def generate_plane_origins(clip):
     # origins of the planes
@@ -89,6 +107,10 @@ def generate_plane_origins(clip):
             origins.InsertPoint(2, [0, 0, clip[2]]) # z
         else:
             origins.InsertPoint(2, [0, 0, 0]) # z
+    else:
+        # SetNumberOfPoints leaves them uninitialized
+        for index in range(3):
+            origins.InsertPoint(index, [0, 0, 0])
     return origins
 
 def generate_plane_normals():
@@ -101,69 +123,151 @@ def generate_plane_normals():
     normals.SetTuple(2, [0, 0, 1])
     return normals
 
-# params: [value, [min, max], [r, g, b, a]]    
-def generate_actors(data, gradient_magnitude, params_list, clip):    
+# tags every contour vertex with the isovalue it was extracted at, so the
+# value survives the probe (which replaces the active scalars with gradients).
+def generate_contour_value_tagger(iso):
+    tagger = vtk.vtkProgrammableFilter()
+    tagger.SetInputConnection(iso.GetOutputPort())
+    
+    def tag():
+        contour = tagger.GetPolyDataInput()
+        output = tagger.GetPolyDataOutput()
+        output.ShallowCopy(contour)
+        scalars = contour.GetPointData().GetScalars()
+        if(scalars):
+            # not every engine names its scalars, so alias them without copying.
+            values = scalars.NewInstance()
+            values.ShallowCopy(scalars)
+            values.SetName(contour_value_array)
+            output.GetPointData().AddArray(values)
+    tagger.SetExecuteMethod(tag)
+    return tagger
+
+# the brick surface of one isovalue tagged like the shared contour.
+def tag_contour_value(surface, value):
+    values = vtk.vtkFloatArray()
+    values.SetName(contour_value_array)
+    values.SetNumberOfTuples(surface.GetNumberOfPoints())
+    values.Fill(value)
+    surface.GetPointData().AddArray(values)
+    return surface
+
+# half the smallest gap between two isovalues, used to split the shared
+# contour back into one surface per isovalue.
+def contour_value_tolerance(iso_values):
+    gaps = [b - a for (a, b) in zip(iso_values, iso_values[1:])]
+    return min(gaps) / 2 if gaps else 0.5
+
+# one surface per isovalue out of the shared contour of source. The cells are
+# partitioned by their isovalue in a single pass over the clipped mesh, and
+# every isovalue's filter hands out its part.
+def split_contour_values(source, iso_values, tolerance):
+    parts = {}
+    partition = vtk.vtkProgrammableFilter()
+    partition.SetInputConnection(source.GetOutputPort())
+
+    def split():
+        surface = partition.GetPolyDataInput()
+        partition.GetPolyDataOutput().ShallowCopy(surface)
+        parts.clear()
+        values = surface.GetPointData().GetArray(contour_value_array)
+        if(values is None or not surface.GetNumberOfPolys()):
+            return
+        polys = surface.GetPolys()
+        offsets = numpy_support.vtk_to_numpy(polys.GetOffsetsArray())
+        connectivity = numpy_support.vtk_to_numpy(polys.GetConnectivityArray())
+        # every vertex of a cell, cut points included, carries its isovalue.
+        cell_values = numpy_support.vtk_to_numpy(values)[connectivity[offsets[:-1]]]
+        targets = np.asarray(iso_values, dtype=np.float64)
+        nearest = np.searchsorted((targets[1:] + targets[:-1]) / 2, cell_values)
+        nearest[np.abs(cell_values - targets[nearest]) > tolerance] = -1
+        for number, value in enumerate(iso_values):
+            keep = nearest == number
+            if(keep.any()):
+                parts[value] = extract_cells(surface, keep)
+    partition.SetExecuteMethod(split)
+
+    splits = {}
+    for value in iso_values:
+        part = vtk.vtkProgrammableFilter()
+        part.SetInputConnection(partition.GetOutputPort())
+        # runs after the partition, its part is ready.
+        part.SetExecuteMethod(lambda part=part, value=value: part.GetPolyDataOutput().ShallowCopy(parts.get(value, vtk.vtkPolyData())))
+        splits[value] = part
+    return splits
+
+# params_list: (value, [min, max], [r, g, b, a]) rows of read_params. The
+# contour, gradient and axis clip stages are shared by every entry, each
+# isovalue is split out once and only the gradient window and the color are
+# per entry.
+def generate_actors(data, gradient_magnitude, params_list, clip, engine, brick_index=None, workers=0, clip_voi=False):    
+    iso_values = sorted(set(params_list['value'].tolist()))
+    
+    # generate vtkPlanes stuff.
+    origins = generate_plane_origins(clip)
+    normals = generate_plane_normals()
+
+    # the list of planes
+    planes = vtk.vtkPlanes()
+    planes.SetPoints(origins)
+    planes.SetNormals(normals)
+    planes.GetPlane(0, xplane)
+    planes.GetPlane(1, yplane)
+    planes.GetPlane(2, zplane)
+    
+    if(brick_index):
+        # (brick, isovalue) units, on a process pool when workers is set. With
+        # clip_voi the bricks are cut to the clip box and the ones outside it skipped.
+        gradient = generate_clip_region_source(
+            lambda region: append_surfaces(tag_contour_value(surface, value) for value, surface in
+                                           extract_parallel(data, gradient_magnitude, iso_values, engine, brick_index, workers, region).items()),
+            data, [xplane, yplane, zplane], clip_voi)
+    else:
+        interpolated = can_interpolate_gradient(engine, data, gradient_magnitude)
+        source = attach_gradient(data, gradient_magnitude) if interpolated else data
+        # contour all the isovalues in a single pass over the volume, only
+        # inside the clip box with clip_voi
+        iso = create_contour_filter(engine, generate_clip_voi(source, [xplane, yplane, zplane]) if clip_voi else source)
+        [iso.SetValue(index, value) for(index, value) in enumerate(iso_values)]
+        tagger = generate_contour_value_tagger(iso)
+        
+        if(interpolated):
+            # gradient interpolated along the edges the contour cut
+            gradient = gradient_scalars(tagger)
+        else:
+            #probe
+            gradient = vtk.vtkProbeFilter()
+            gradient.SetInputConnection(tagger.GetOutputPort())
+            gradient.SetSourceConnection(gradient_magnitude.GetOutputPort())
+            gradient.PassPointArraysOn()
+    
+    # the three planes once for every isovalue
+    clipper = FusedClip(gradient, [xplane, yplane, zplane])
+    watch_pipeline(clipper.clipper, 'FusedClip (planes)')
+    
+    # each isovalue's surface out of the shared clipped contour
+    splits = split_contour_values(clipper, iso_values, contour_value_tolerance(iso_values))
+    
     actors = []
     for params in params_list:
-        # contour
-        iso = vtk.vtkContourFilter()
-        iso.SetInputConnection(data.GetOutputPort())
-        iso.SetValue(0, params[0])    
-        
-        
-        #probe
-        probe = vtk.vtkProbeFilter()
-        probe.SetInputConnection(iso.GetOutputPort())
-        probe.SetSourceConnection(gradient_magnitude.GetOutputPort())
-    
-        # generate vtkPlanes stuff.
-        origins = generate_plane_origins(clip)
-        normals = generate_plane_normals()
-    
-        # the list of planes
-        planes = vtk.vtkPlanes()
-        planes.SetPoints(origins)
-        planes.SetNormals(normals)
-        planes.GetPlane(0, xplane)
-        planes.GetPlane(1, yplane)
-        planes.GetPlane(2, zplane)
-        
-        xclipper = vtk.vtkClipPolyData()
-        xclipper.SetInputConnection(probe.GetOutputPort())
-        xclipper.SetClipFunction(xplane)
-        
-        yclipper = vtk.vtkClipPolyData()
-        yclipper.SetInputConnection(xclipper.GetOutputPort())
-        yclipper.SetClipFunction(yplane)
-        
-        zclipper = vtk.vtkClipPolyData()
-        zclipper.SetInputConnection(yclipper.GetOutputPort())
-        zclipper.SetClipFunction(zplane)
-        
-        min_grad_clipper = vtk.vtkClipPolyData()
-        min_grad_clipper.SetInputConnection(zclipper.GetOutputPort())
-        min_grad_clipper.InsideOutOff()
-        min_grad_clipper.SetValue(params[1][0])
-        min_grad_clipper.Update()
-    
-        max_grad_clipper = vtk.vtkClipPolyData()
-        max_grad_clipper.SetInputConnection(min_grad_clipper.GetOutputPort())
-        max_grad_clipper.InsideOutOn()
-        max_grad_clipper.SetValue(params[1][1])
-        max_grad_clipper.Update()
-        
-        ctf = generate_ctf(params[1][0], params[1][1], params[2][0], params[2][1], params[2][2],)
+        # the gradient window of the entry
+        low, high = params['gradient']
+        r, g, b, opacity = params['rgba']
+        window = FusedClip(splits[params['value']], gradient_range=(low, high))
+        watch_pipeline(window.clipper, 'FusedClip (gradient window)')
+        window.Update()
         
         clipMapper = vtk.vtkDataSetMapper()
-        clipMapper.SetLookupTable(ctf)
-        clipMapper.SetInputConnection(max_grad_clipper.GetOutputPort())
-        clipMapper.SetScalarRange(0, 255)
+        clipMapper.SetInputConnection(window.GetOutputPort())
+        # every scalar of the window maps to the same color, no lookup table needed
+        clipMapper.ScalarVisibilityOff()
     
         
         # Generate iso surface actor from iso surface mapper.
         actor = vtk.vtkActor()
         actor.SetMapper(clipMapper)
-        actor.GetProperty().SetOpacity(params[2][3])
+        actor.GetProperty().SetColor(r, g, b)
+        actor.GetProperty().SetOpacity(opacity)
         actors.append(actor)
         
     return actors
@@ -267,7 +371,7 @@ def z_axis_custom_callback(obj, event):
     global zplane
     zplane.SetOrigin(0, 0, value)
 
-def generate_gui(actors, clip):
+def generate_gui(actors, clip, throttle):
     actorBounds = actors[0].GetBounds()
     maxX = int(actorBounds[1] + 1)
     maxY = int(actorBounds[3] + 1)
@@ -279,6 +383,8 @@ def generate_gui(actors, clip):
     renderer_window.AddRenderer(renderer)
     renderer_window_interactor = vtk.vtkRenderWindowInteractor()
     renderer_window_interactor.SetRenderWindow(renderer_window)
+    # the sliders update the pipeline at a bounded rate
+    sliders = SliderThrottle(renderer_window_interactor, throttle['interval'], throttle['debounce'])
     
     renderer_window.SetAlphaBitPlanes(1)
     renderer_window.SetMultiSamples(0)
@@ -291,7 +397,8 @@ def generate_gui(actors, clip):
     x_axis_slider_widget = vtk.vtkSliderWidget()
     x_axis_slider_widget.SetInteractor(renderer_window_interactor)
     x_axis_slider_widget.SetRepresentation(x_axis_slide_bar)
-    x_axis_slider_widget.AddObserver("InteractionEvent", x_axis_custom_callback)
+    sliders.observe(x_axis_slider_widget, x_axis_custom_callback)
+    observe_widget(x_axis_slider_widget, 'x clip')
     x_axis_slider_widget.EnabledOn()
     
     
@@ -300,7 +407,8 @@ def generate_gui(actors, clip):
     y_axis_slider_widget = vtk.vtkSliderWidget()
     y_axis_slider_widget.SetInteractor(renderer_window_interactor)
     y_axis_slider_widget.SetRepresentation(y_axis_slide_bar)
-    y_axis_slider_widget.AddObserver("InteractionEvent", y_axis_custom_callback)
+    sliders.observe(y_axis_slider_widget, y_axis_custom_callback)
+    observe_widget(y_axis_slider_widget, 'y clip')
     y_axis_slider_widget.EnabledOn()
     
     
@@ -309,7 +417,8 @@ def generate_gui(actors, clip):
     z_axis_slider_widget = vtk.vtkSliderWidget()
     z_axis_slider_widget.SetInteractor(renderer_window_interactor)
     z_axis_slider_widget.SetRepresentation(z_axis_slide_bar)
-    z_axis_slider_widget.AddObserver("InteractionEvent", z_axis_custom_callback)
+    sliders.observe(z_axis_slider_widget, z_axis_custom_callback)
+    observe_widget(z_axis_slider_widget, 'z clip')
     z_axis_slider_widget.EnabledOn()
     
     # Add the actors and camera to the renderer, set background and size
@@ -329,6 +438,8 @@ def generate_gui(actors, clip):
     
     # Smoother camera controls
     renderer_window_interactor.GetInteractorStyle().SetCurrentStyleToTrackballCamera();
+    # event-to-frame latency of the sliders
+    observe_window(renderer, renderer_window)
     renderer_window_interactor.Initialize()
     renderer_window.Render()
     renderer_window.SetWindowName('Iso2DTF')
@@ -337,17 +448,39 @@ def generate_gui(actors, clip):
 
 def main():
     # Get file paths from cli params.
-    data_file, grad_file, params_file, clip = get_program_parameters()
+    data_file, grad_file, params_file, clip, engine, mapped, brick_size, workers, clip_voi, batch, cache_tables, profile, latency, throttle = get_program_parameters()
+    start_profiling(profile)
+    start_latency(latency)
     
     # Read data file.
-    data = read_file(data_file)
-    gradient_magnitude = read_file(grad_file)
-    params = read_params(params_file)
+    with stage('read'):
+        data = read_file(data_file, mapped=mapped)
+    with stage('gradient'):
+        if(grad_file):
+            gradient_magnitude = read_file(grad_file, mapped=mapped)
+        elif(data):
+            # central differences of the loaded volume, cached next to data_file
+            gradient_magnitude = load_gradient_magnitude(data_file, data, mapped)
+        else:
+            gradient_magnitude = None
+    with stage('tables'):
+        params = read_params(params_file, cache_tables)
     
     if(data):
-        actors = generate_actors(data, gradient_magnitude, params, clip)
-        # Generate GUI
-        generate_gui(actors, clip)        
+        if(workers and not brick_size):
+            brick_size = parallel_brick_size
+        # per-brick scalar ranges, shared with the span index files
+        with stage('span index'):
+            brick_index = load_span_index(data_file, data.GetOutput(), brick_size) if brick_size else None
+        with stage('generate_actors'):
+            actors = generate_actors(data, gradient_magnitude, params, clip, engine, brick_index, workers, clip_voi)
+        watch_actors(actors)
+        if(batch):
+            # headless: write the meshes and/or the render, then exit
+            run_batch(actors, batch, zoom=1)
+        else:
+            # Generate GUI
+            generate_gui(actors, clip, throttle)        
     else:
         print('The data file was not found or the file provided does not match neither the .vti and .vtp extension.')
     
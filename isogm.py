@@ -6,6 +6,20 @@ Created on Sat Oct 10 09:56:01 2020
 @author: Cristhyan De Marchena
 """
 import vtk
+from mmap_reader import add_mmap_argument, mapped_extensions, read_mapped, scalar_range
+from contour_engine import add_engine_argument, create_contour_filter
+from bricks import add_brick_argument, merge_surfaces, stream_brick_surfaces
+from span_index import load_span_index
+from gradient_volume import add_gradient_argument, gradient_file_argument, load_gradient_magnitude
+from fused_clip import FusedClip
+from batch_output import add_batch_arguments, batch_options, run_batch
+from clip_voi import add_clip_voi_argument, generate_clip_region_source, generate_clip_voi
+from parallel_extract import add_workers_argument, extract_parallel, parallel_brick_size
+from text_tables import add_table_cache_argument, cmap_dtype, isovalue_dtype, load_table
+from transfer_function import TransferFunction
+from interaction_latency import add_latency_arguments, latency_options, observe_widget, observe_window, start_latency
+from slider_throttle import SliderThrottle, add_throttle_arguments, throttle_options
+from pipeline_profile import add_profile_arguments, profile_options, stage, start_profiling, watch_actors
 
 # Min and max value from data
 max = 0
@@ -30,66 +44,61 @@ def get_program_parameters():
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('data_file', nargs='?', default=None, help='data file')
-    parser.add_argument('grad_file', nargs='?', default=None, help='grad map file')
+    parser.add_argument('grad_file', nargs='?', default=None, help='grad map file ("-" computes it from the data file)')
     parser.add_argument('isoval_file', nargs='?', default=None, help='iso value')
     parser.add_argument('--cmap', dest='cmap_file', default=None, help='Colormap file')
     parser.add_argument('--clip', dest='clip', nargs=3, type=int, default=None)
+    add_engine_argument(parser)
+    add_mmap_argument(parser)
+    add_clip_voi_argument(parser)
+    add_batch_arguments(parser)
+    add_gradient_argument(parser)
+    add_brick_argument(parser)
+    add_workers_argument(parser)
+    add_table_cache_argument(parser)
+    add_profile_arguments(parser)
+    add_latency_arguments(parser)
+    add_throttle_arguments(parser)
     args = parser.parse_args()
+    batch = batch_options(parser, args)
     
-    return args.data_file, args.grad_file, args.isoval_file, args.cmap_file, args.clip
+    return args.data_file, gradient_file_argument(args.grad_file, args.compute_gradient), args.isoval_file, args.cmap_file, args.clip, args.engine, args.mmap, args.brick_size, args.workers, args.clip_voi, batch, args.cache_tables, profile_options(parser, args), latency_options(parser, args), throttle_options(args)
 
-def read_file(file_name):
+def read_file(file_name, mapped=False):
     import os
+    reader = None
     if(file_name):
         path, extension = os.path.splitext(file_name)
         extension = extension.lower()
-        if extension == ".vti":
+        if(mapped and extension in mapped_extensions):
+            # zero-copy memory map, paged in as the filters touch it
+            reader = read_mapped(file_name)
+        if(reader is None and extension == ".vti"):
             reader = vtk.vtkXMLImageDataReader()
             reader.SetFileName(file_name)
             reader.Update()
-        else:
-            # the file provided doesn't match the accepted extenstions
-            reader = None
-    else:
-        reader = None
+        # reader stays None if the file provided doesn't match the accepted extenstions
     return reader
 
-# list of singleton values.
-def read_isovalues(file_name):
-    values = list()
-    with open(file_name) as file:
-        line = file.readline()
-        while line:
-            if not line.startswith("#"):
-                values.append(int(line))
-            line = file.readline()
-    return values
+# array of singleton values.
+def read_isovalues(file_name, cache=False):
+    return load_table(file_name, isovalue_dtype, cache)['value']
 
-# list of <value> <r> <g> <b>, separated by and space.
-def read_cmap(file_name):
-    values = list()
-    with open(file_name) as file:
-        line = file.readline()
-        while line:
-            if not line.startswith("#"):
-                arr = line.split(" ")
-                value, r, g, b = arr
-                rgb = [int(r)/255, int(g)/255, int(b)/255]                
-                values.append([int(value), rgb])
-            line = file.readline()
-    return values
+# (value, rgb) rows of <value> <r> <g> <b>, rgb in 0..255 scaled to 0..1.
+def read_cmap(file_name, cache=False):
+    cmap = load_table(file_name, cmap_dtype, cache)
+    cmap['rgb'] /= 255
+    return cmap
 
-def generate_ctf(cmap):
-    ctf = vtk.vtkColorTransferFunction()
-    if(cmap):
-        [ctf.AddRGBPoint(value, rgb[0], rgb[1], rgb[2]) for(value, rgb) in cmap]
-    else:
-        ctf.AddRGBPoint(min, 31/255, 162/255, 255/255)
-        ctf.AddRGBPoint(max/4, 163/255, 99/255, 235/255)
-        ctf.AddRGBPoint(max/2, 255/255, 102/255, 102/255)
-        ctf.AddRGBPoint(max *3/4, 235/255, 183/255, 113/255)
-        ctf.AddRGBPoint(max, 255/255, 251/255, 19/255)
-    return ctf    
+def generate_transfer_function(cmap):
+    if(cmap is not None and len(cmap)):
+        return TransferFunction.from_rgb(cmap['value'], cmap['rgb'])
+    return TransferFunction.from_rgb([min, max/4, max/2, max *3/4, max],
+                                     [[31/255, 162/255, 255/255],
+                                      [163/255, 99/255, 235/255],
+                                      [255/255, 102/255, 102/255],
+                                      [235/255, 183/255, 113/255],
+                                      [255/255, 251/255, 19/255]])
     
     
 def generate_plane_origins(clip):
@@ -111,6 +120,10 @@ def generate_plane_origins(clip):
             origins.InsertPoint(2, [0, 0, clip[2]]) # z
         else:
             origins.InsertPoint(2, [0, 0, 0]) # z
+    else:
+        # SetNumberOfPoints leaves them uninitialized
+        for index in range(3):
+            origins.InsertPoint(index, [0, 0, 0])
     return origins
 
 def generate_plane_normals():
@@ -123,20 +136,7 @@ def generate_plane_normals():
     normals.SetTuple(2, [0, 0, 1])
     return normals
     
-def generate_actors(data, gradient_magnitude, iso_values, cmap, clip):    
-    # contour
-    iso = vtk.vtkContourFilter()
-    iso.SetInputConnection(data.GetOutputPort())
-    if(iso_values):
-        [iso.SetValue(index, value) for(index, value) in enumerate(iso_values)]
-    else:
-        iso.SetValue(0, max/4)
-    
-    #probe
-    probe = vtk.vtkProbeFilter()
-    probe.SetInputConnection(iso.GetOutputPort())
-    probe.SetSourceConnection(gradient_magnitude.GetOutputPort())
-
+def generate_actors(data, gradient_magnitude, iso_values, cmap, clip, engine, brick_index=None, workers=0, clip_voi=False):    
     # generate vtkPlanes stuff.
     origins = generate_plane_origins(clip)
     normals = generate_plane_normals()
@@ -149,24 +149,42 @@ def generate_actors(data, gradient_magnitude, iso_values, cmap, clip):
     planes.GetPlane(1, yplane)
     planes.GetPlane(2, zplane)
     
-    xclipper = vtk.vtkClipPolyData()
-    xclipper.SetInputConnection(probe.GetOutputPort())
-    xclipper.SetClipFunction(xplane)
-    
-    yclipper = vtk.vtkClipPolyData()
-    yclipper.SetInputConnection(xclipper.GetOutputPort())
-    yclipper.SetClipFunction(yplane)
-    
-    zclipper = vtk.vtkClipPolyData()
-    zclipper.SetInputConnection(yclipper.GetOutputPort())
-    zclipper.SetClipFunction(zplane)
+    # with clip_voi the bricks are cut to the clip box and the ones outside it skipped
+    if(brick_index and workers):
+        # (brick, isovalue) units on a process pool, merged into one surface
+        values = iso_values if len(iso_values) else [max/4]
+        probe = generate_clip_region_source(
+            lambda region: merge_surfaces(extract_parallel(data, gradient_magnitude, values, engine, brick_index, workers, region).values()),
+            data, [xplane, yplane, zplane], clip_voi)
+    elif(brick_index):
+        # contour and probe brick by brick, skipping the bricks no isovalue crosses
+        values = iso_values if len(iso_values) else [max/4]
+        probe = generate_clip_region_source(
+            lambda region: merge_surfaces(stream_brick_surfaces(data, gradient_magnitude, values, engine, brick_index, region)),
+            data, [xplane, yplane, zplane], clip_voi)
+    else:
+        # contour, only inside the clip box with clip_voi
+        iso = create_contour_filter(engine, generate_clip_voi(data, [xplane, yplane, zplane]) if clip_voi else data)
+        if(len(iso_values)):
+            [iso.SetValue(index, value) for(index, value) in enumerate(iso_values)]
+        else:
+            iso.SetValue(0, max/4)
+        
+        #probe
+        probe = vtk.vtkProbeFilter()
+        probe.SetInputConnection(iso.GetOutputPort())
+        probe.SetSourceConnection(gradient_magnitude.GetOutputPort())
+
+    # the three planes in a single clip pass
+    clipper = FusedClip(probe, [xplane, yplane, zplane])
     
-    ctf = generate_ctf(cmap)
+    transfer_function = generate_transfer_function(cmap)
     
     clipMapper = vtk.vtkDataSetMapper()
-    clipMapper.SetLookupTable(ctf)
-    clipMapper.SetInputConnection(zclipper.GetOutputPort())
-    clipMapper.SetScalarRange(0, 255)
+    clipMapper.SetLookupTable(transfer_function.lookup_table())
+    clipMapper.SetInputConnection(clipper.GetOutputPort())
+    # the table spans the transfer function
+    clipMapper.UseLookupTableScalarRangeOn()
 
     
     # Generate iso surface actor from iso surface mapper.
@@ -274,7 +292,7 @@ def z_axis_custom_callback(obj, event):
     global zplane
     zplane.SetOrigin(0, 0, value)
 
-def generate_gui(actors, cmap, clip):
+def generate_gui(actors, cmap, clip, throttle):
     actorBounds = actors[0].GetBounds()
     maxX = int(actorBounds[1] + 1)
     maxY = int(actorBounds[3] + 1)
@@ -286,13 +304,16 @@ def generate_gui(actors, cmap, clip):
     renderer_window.AddRenderer(renderer)
     renderer_window_interactor = vtk.vtkRenderWindowInteractor()
     renderer_window_interactor.SetRenderWindow(renderer_window)
+    # the sliders update the pipeline at a bounded rate
+    sliders = SliderThrottle(renderer_window_interactor, throttle['interval'], throttle['debounce'])
     
     # Add x-axis slide bar   
     x_axis_slide_bar = generate_x_axis_slide_bar(maxX, clip[0]) if clip else generate_x_axis_slide_bar(maxX, 0)
     x_axis_slider_widget = vtk.vtkSliderWidget()
     x_axis_slider_widget.SetInteractor(renderer_window_interactor)
     x_axis_slider_widget.SetRepresentation(x_axis_slide_bar)
-    x_axis_slider_widget.AddObserver("InteractionEvent", x_axis_custom_callback)
+    sliders.observe(x_axis_slider_widget, x_axis_custom_callback)
+    observe_widget(x_axis_slider_widget, 'x clip')
     x_axis_slider_widget.EnabledOn()
     
     
@@ -301,7 +322,8 @@ def generate_gui(actors, cmap, clip):
     y_axis_slider_widget = vtk.vtkSliderWidget()
     y_axis_slider_widget.SetInteractor(renderer_window_interactor)
     y_axis_slider_widget.SetRepresentation(y_axis_slide_bar)
-    y_axis_slider_widget.AddObserver("InteractionEvent", y_axis_custom_callback)
+    sliders.observe(y_axis_slider_widget, y_axis_custom_callback)
+    observe_widget(y_axis_slider_widget, 'y clip')
     y_axis_slider_widget.EnabledOn()
     
     
@@ -310,18 +332,17 @@ def generate_gui(actors, cmap, clip):
     z_axis_slider_widget = vtk.vtkSliderWidget()
     z_axis_slider_widget.SetInteractor(renderer_window_interactor)
     z_axis_slider_widget.SetRepresentation(z_axis_slide_bar)
-    z_axis_slider_widget.AddObserver("InteractionEvent", z_axis_custom_callback)
+    sliders.observe(z_axis_slider_widget, z_axis_custom_callback)
+    observe_widget(z_axis_slider_widget, 'z clip')
     z_axis_slider_widget.EnabledOn()
     
-    ctf = generate_ctf(cmap)
-    
     scalar_bar = vtk.vtkScalarBarActor()
     scalar_bar.SetOrientationToHorizontal()
     scalar_bar.SetTextPositionToPrecedeScalarBar()
     scalar_bar.UnconstrainedFontSizeOff()
-    # Pops CTF from the actors' list
-    scalar_bar.SetLookupTable(ctf)
-    scalar_bar.SetNumberOfLabels(len(cmap) if cmap else 5)
+    # Pops the lookup table from the actors' list
+    scalar_bar.SetLookupTable(actors[0].GetMapper().GetLookupTable())
+    scalar_bar.SetNumberOfLabels(len(cmap) if cmap is not None and len(cmap) else 5)
     scalar_bar.SetLabelFormat("%-6.0f")
     
     scalar_bar.SetPosition(0.24, 0.02)
@@ -345,6 +366,8 @@ def generate_gui(actors, cmap, clip):
     
     # Smoother camera controls
     renderer_window_interactor.GetInteractorStyle().SetCurrentStyleToTrackballCamera();
+    # event-to-frame latency of the sliders
+    observe_window(renderer, renderer_window)
     renderer_window_interactor.Initialize()
     renderer_window.Render()
     renderer_window.SetWindowName('IsoGM')
@@ -353,7 +376,7 @@ def generate_gui(actors, cmap, clip):
     
 
 def update_max_min_from_data(data):
-    _min, _max = data.GetOutput().GetScalarRange()
+    _min, _max = scalar_range(data.GetOutput())
     global min
     global max
     min = _min 
@@ -361,22 +384,44 @@ def update_max_min_from_data(data):
 
 def main():
     # Get file paths from cli params.
-    data_file, grad_file, isoval_file, cmap_file, clip = get_program_parameters()
+    data_file, grad_file, isoval_file, cmap_file, clip, engine, mapped, brick_size, workers, clip_voi, batch, cache_tables, profile, latency, throttle = get_program_parameters()
+    start_profiling(profile)
+    start_latency(latency)
     
     # Read data file.
-    data = read_file(data_file)
-    gradient_magnitude = read_file(grad_file)
-    iso_values = read_isovalues(isoval_file)
-    cmap = read_cmap(cmap_file) if cmap_file else None
+    with stage('read'):
+        data = read_file(data_file, mapped=mapped)
+    with stage('gradient'):
+        if(grad_file):
+            gradient_magnitude = read_file(grad_file, mapped=mapped)
+        elif(data):
+            # central differences of the loaded volume, cached next to data_file
+            gradient_magnitude = load_gradient_magnitude(data_file, data, mapped)
+        else:
+            gradient_magnitude = None
+    with stage('tables'):
+        iso_values = read_isovalues(isoval_file, cache_tables)
+        cmap = read_cmap(cmap_file, cache_tables) if cmap_file else None
     
     
     # update min and max
     update_max_min_from_data(gradient_magnitude)
     
     if(data):
-        actors = generate_actors(data, gradient_magnitude, iso_values, cmap, clip)
-        # Generate GUI
-        generate_gui(actors, cmap, clip)        
+        # per-brick scalar ranges, shared with the span index files
+        if(workers and not brick_size):
+            brick_size = parallel_brick_size
+        with stage('span index'):
+            brick_index = load_span_index(data_file, data.GetOutput(), brick_size) if brick_size else None
+        with stage('generate_actors'):
+            actors = generate_actors(data, gradient_magnitude, iso_values, cmap, clip, engine, brick_index, workers, clip_voi)
+        watch_actors(actors)
+        if(batch):
+            # headless: write the meshes and/or the render, then exit
+            run_batch(actors, batch, zoom=0.8)
+        else:
+            # Generate GUI
+            generate_gui(actors, cmap, clip, throttle)        
     else:
         print('The data file was not found or the file provided does not match neither the .vti and .vtp extension.')
     
@@ -6,12 +6,49 @@ Created on Sat Oct 10 09:58:01 2020
 @author: Cristhyan De Marchena
 """
 import vtk
+from mmap_reader import add_mmap_argument, mapped_extensions, read_mapped, scalar_range
+from contour_engine import add_engine_argument, create_contour_filter
+from span_index import RegionContour, contour_active_regions, load_span_index
+from surface_cache import SurfaceCache, add_cache_arguments
+from fused_clip import FusedClip
+from batch_output import add_batch_arguments, batch_options, run_batch
+from clip_voi import add_clip_voi_argument, clip_extent
+from volume_pyramid import add_lod_arguments, build_pyramid, coarsest_level, observe_camera_interaction, pyramid_level, release_pyramid
+from time_series import TimeSeries, add_time_series_arguments, time_series_files, timestep_file
+from temporal_contour import IncrementalContour, add_incremental_arguments
+from interaction_latency import add_latency_arguments, latency_options, observe_widget, observe_window, start_latency
+from slider_throttle import SliderThrottle, add_throttle_arguments, throttle_options
+from pipeline_profile import add_profile_arguments, profile_options, stage, start_profiling, watch, watch_actors
 
 # Script params
 val = 0
 
-# Countour filter
-iso = vtk.vtkContourFilter()
+# Countour stage, the isosurface contoured over the span index' active blocks
+iso = RegionContour()
+iso_data = None
+iso_engine = None
+span_index = None
+
+# Extracted isosurfaces by (file, isovalue, engine), fed to the pipeline through surface
+surface_cache = SurfaceCache()
+surface = vtk.vtkTrivialProducer()
+iso_file = None
+
+# Interactive contour on a coarse pyramid level, and the isovalue on display
+lod_iso = None
+iso_value = None
+
+# Clip-before-contour: only the clip box of the volume is contoured
+clip_voi = False
+
+# Time series: files of the timesteps, their decoded volumes and span indexes,
+# and the timestep on display
+series_files = None
+series = None
+timestep = 0
+
+# Incremental mode: the blocks unchanged since the previous timestep keep their triangles
+incremental = None
 
 # Min and max value from data
 max = 0
@@ -35,35 +72,74 @@ white = 242/255
 def get_program_parameters():
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('data_file', nargs='?', default=None, help='data file')
+    parser.add_argument('data_file', nargs='?', default=None,
+                        help='data file, or the timesteps as a glob pattern (quoted) or a .pvd')
     parser.add_argument('--val', dest='value', type=int, default=None, help='initial isovalue')
     parser.add_argument('--clip', dest='clip', nargs=3, type=int, default=None)
+    add_engine_argument(parser)
+    add_cache_arguments(parser)
+    add_lod_arguments(parser)
+    add_mmap_argument(parser)
+    add_clip_voi_argument(parser)
+    add_batch_arguments(parser)
+    add_time_series_arguments(parser)
+    add_incremental_arguments(parser)
+    add_profile_arguments(parser)
+    add_latency_arguments(parser)
+    add_throttle_arguments(parser)
     args = parser.parse_args()
+    batch = batch_options(parser, args)
     
-    return args.data_file, args.value, args.clip
+    return args.data_file, args.value, args.clip, args.engine, args.cache_mb, args.cache_dir, args.lod_levels, args.mmap, args.clip_voi, batch, args.prefetch, args.time_cache, args.incremental, args.temporal_tolerance, profile_options(parser, args), latency_options(parser, args), throttle_options(args)
+
+def read_file(file_name, lod_levels=None, mapped=False):
+    reader = read_volume(file_name, lod_levels, mapped)
+    if(reader):
+        # Read min and max
+        global min
+        global max
+        _min, _max = scalar_range(reader.GetOutput())
+        min = _min 
+        max = _max
+    return reader
 
-def read_file(file_name):
+# read_file without the min and max update, for the prefetched timesteps.
+def read_volume(file_name, lod_levels=None, mapped=False):
     import os
+    reader = None
     if(file_name):
         path, extension = os.path.splitext(file_name)
         extension = extension.lower()
-        if extension == ".vti":
+        if(mapped and extension in mapped_extensions):
+            # zero-copy memory map, paged in as the filters touch it
+            reader = read_mapped(file_name)
+        if(reader is None and extension == ".vti"):
             reader = vtk.vtkXMLImageDataReader()
             reader.SetFileName(file_name)
             reader.Update()
-            # Read min and max
-            global min
-            global max
-            _min, _max = reader.GetOutput().GetScalarRange()
-            min = _min 
-            max = _max
-        else:
-            # the file provided doesn't match the accepted extenstions
-            reader = None
-    else:
-        reader = None
+        # reader stays None if the file provided doesn't match the accepted extenstions
+    if(reader):
+        build_pyramid(reader, lod_levels)
     return reader
 
+# volume and span index of a timestep, read on the prefetch thread.
+def read_timestep(index, lod_levels=None, mapped=False):
+    data = read_volume(series_files[index], lod_levels, mapped)
+    if(data is None):
+        raise ValueError(series_files[index] + ' is not a .vti file')
+    return data, load_span_index(series_files[index], data.GetOutput())
+
+def release_timestep(volume):
+    release_pyramid(volume[0])
+
+# shows timestep index at the isovalue on display.
+def set_timestep(index, level=0):
+    global iso_data, span_index, iso_file, timestep
+    iso_data, span_index = series.get(index)
+    iso_file = series_files[index]
+    timestep = index
+    update_isosurface(iso_value, level)
+
 def generate_plane_origins(clip):
     # origins of the planes
     origins = vtk.vtkPoints()
@@ -83,6 +159,10 @@ def generate_plane_origins(clip):
             origins.InsertPoint(2, [0, 0, clip[2]]) # z
         else:
             origins.InsertPoint(2, [0, 0, 0]) # z
+    else:
+        # SetNumberOfPoints leaves them uninitialized
+        for index in range(3):
+            origins.InsertPoint(index, [0, 0, 0])
     return origins
 
 def generate_plane_normals():
@@ -95,14 +175,12 @@ def generate_plane_normals():
     normals.SetTuple(2, [0, 0, 1])
     return normals
     
-def generate_actors(data, val, clip):    
+def generate_actors(data, val, clip, engine):    
     # contour
-    global iso
-    iso.SetInputConnection(data.GetOutputPort())
-    if(val):
-        iso.SetValue(0, val)    
-    else:
-        iso.SetValue(0, max/4)
+    global iso_data, iso_engine, lod_iso
+    iso_data = data
+    iso_engine = engine
+    lod_iso = watch(create_contour_filter(engine, pyramid_level(data, coarsest_level(data))), 'contour (coarse)')
     
     ctf = vtk.vtkColorTransferFunction()
     ctf.AddRGBPoint(min, 31/255, 162/255, 255/255)
@@ -120,22 +198,19 @@ def generate_actors(data, val, clip):
     planes.GetPlane(1, yplane)
     planes.GetPlane(2, zplane)
     
-    xclipper = vtk.vtkClipPolyData()
-    xclipper.SetInputConnection(iso.GetOutputPort())
-    xclipper.SetClipFunction(xplane)
-    
-    yclipper = vtk.vtkClipPolyData()
-    yclipper.SetInputConnection(xclipper.GetOutputPort())
-    yclipper.SetClipFunction(yplane)
+    # after the planes, clip-before-contour needs the clip box
+    if(val):
+        update_isosurface(val)
+    else:
+        update_isosurface(max/4)
     
-    zclipper = vtk.vtkClipPolyData()
-    zclipper.SetInputConnection(yclipper.GetOutputPort())
-    zclipper.SetClipFunction(zplane)
+    # the three planes in a single clip pass
+    clipper = FusedClip(surface, [xplane, yplane, zplane])
     
     
     clipMapper = vtk.vtkDataSetMapper()
     clipMapper.SetLookupTable(ctf)
-    clipMapper.SetInputConnection(zclipper.GetOutputPort())
+    clipMapper.SetInputConnection(clipper.GetOutputPort())
     clipMapper.SetScalarRange(0, 255)
 
     
@@ -179,11 +254,80 @@ def generate_iso_slide_bar(value):
     slide_bar.GetPoint2Coordinate().SetValue(0.98 , 0.1)
     return slide_bar
 
+# extent of the clip box in clip-before-contour mode, None otherwise.
+def clip_region():
+    return clip_extent(iso_data.GetOutput(), [xplane, yplane, zplane]) if(clip_voi) else None
+
+# level > 0 contours that pyramid level, used while the user interacts.
+def update_isosurface(value, level=0):
+    global iso_value
+    iso_value = value
+    if(level and coarsest_level(iso_data)):
+        lod_iso.SetInputConnection(pyramid_level(iso_data, level).GetOutputPort())
+        lod_iso.SetValue(0, value)
+        lod_iso.Update()
+        surface.SetOutput(lod_iso.GetOutput())
+        return
+    region = clip_region()
+    key = surface_cache.key(iso_file, value, iso_engine, region)
+    cached = surface_cache.get(key)
+    if(cached is None and incremental):
+        # only the blocks that changed since the previous contour
+        with stage('contour (incremental)'):
+            cached = surface_cache.put(key, incremental.contour(iso_data, span_index, key[1], iso_engine, region))
+    elif(cached is None):
+        # only the blocks straddling value get contoured.
+        with stage('contour (span index)'):
+            cached = surface_cache.put(key, contour_active_regions(iso, iso_data, span_index, key[1], iso_engine, region))
+    surface.SetOutput(cached)
+
 def custom_iso_callback(obj, event):
     value = int (obj.GetRepresentation().GetValue())
-    global iso
-    iso.SetValue(0, value)
-    iso.Update()
+    update_isosurface(value, coarsest_level(iso_data))
+
+def custom_iso_end_callback(obj, event):
+    value = int (obj.GetRepresentation().GetValue())
+    update_isosurface(value)
+
+def generate_time_slide_bar():
+    # Create Slidebar
+    slide_bar = vtk.vtkSliderRepresentation2D()
+    
+    # Set range and title.
+    slide_bar.SetMinimumValue(0)
+    slide_bar.SetMaximumValue(len(series_files) - 1)
+    slide_bar.SetValue(timestep)
+    slide_bar.SetLabelFormat("%0.0f")
+    slide_bar.SetTitleText("Time step")
+    
+    # Set colors.
+    slide_bar = set_slide_bar_colors(slide_bar)
+    
+    # Set coordinates.
+    slide_bar.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
+    slide_bar.GetPoint1Coordinate().SetValue(0.78, 0.7)
+    
+    slide_bar.GetPoint2Coordinate().SetCoordinateSystemToNormalizedDisplay()
+    slide_bar.GetPoint2Coordinate().SetValue(0.98 , 0.7)
+    return slide_bar
+
+# coarse while the slider moves, the next timesteps are already being read.
+def custom_time_callback(obj, event):
+    index = int(round(obj.GetRepresentation().GetValue()))
+    if(index != timestep):
+        set_timestep(index, coarsest_level(iso_data))
+
+def custom_time_end_callback(obj, event):
+    index = int(round(obj.GetRepresentation().GetValue()))
+    obj.GetRepresentation().SetValue(index)
+    set_timestep(index)
+
+def camera_start_callback(obj, event):
+    update_isosurface(iso_value, coarsest_level(iso_data))
+
+def camera_end_callback(obj, event):
+    update_isosurface(iso_value)
+    obj.GetInteractor().Render()
 
 def generate_x_axis_slide_bar(max, value):
     # Create Slidebar
@@ -215,6 +359,7 @@ def x_axis_custom_callback(obj, event):
     value = int (obj.GetRepresentation().GetValue())
     global xplane
     xplane.SetOrigin(value, 0, 0)
+    clip_moved()
 
 def generate_y_axis_slide_bar(max, value):
     # Create Slidebar
@@ -245,6 +390,7 @@ def y_axis_custom_callback(obj, event):
     value = int (obj.GetRepresentation().GetValue())
     global yplane
     yplane.SetOrigin(0, value, 0)
+    clip_moved()
 
 def generate_z_axis_slide_bar(max, value):
     # Create Slidebar
@@ -274,8 +420,18 @@ def z_axis_custom_callback(obj, event):
     value = int (obj.GetRepresentation().GetValue())
     global zplane
     zplane.SetOrigin(0, 0, value)
+    clip_moved()
 
-def generate_gui(actors, val, clip):
+# the clip box changed what gets contoured, coarse while the slider moves.
+def clip_moved():
+    if(clip_voi):
+        update_isosurface(iso_value, coarsest_level(iso_data))
+
+def clip_end_callback(obj, event):
+    if(clip_voi):
+        update_isosurface(iso_value)
+
+def generate_gui(actors, val, clip, throttle):
     actorBounds = actors[0].GetBounds()
     maxX = int(actorBounds[1] + 1)
     maxY = int(actorBounds[3] + 1)
@@ -287,21 +443,34 @@ def generate_gui(actors, val, clip):
     renderer_window.AddRenderer(renderer)
     renderer_window_interactor = vtk.vtkRenderWindowInteractor()
     renderer_window_interactor.SetRenderWindow(renderer_window)
+    # the sliders update the pipeline at a bounded rate
+    sliders = SliderThrottle(renderer_window_interactor, throttle['interval'], throttle['debounce'])
     
     # Add iso slide bar   
     iso_slide_bar = generate_iso_slide_bar(val)
     iso_slider_widget = vtk.vtkSliderWidget()
     iso_slider_widget.SetInteractor(renderer_window_interactor)
     iso_slider_widget.SetRepresentation(iso_slide_bar)
-    iso_slider_widget.AddObserver("InteractionEvent", custom_iso_callback)
+    sliders.observe(iso_slider_widget, custom_iso_callback, custom_iso_end_callback)
+    observe_widget(iso_slider_widget, 'isovalue')
     iso_slider_widget.EnabledOn()
     
+    # Add time slide bar
+    if(series):
+        time_slider_widget = vtk.vtkSliderWidget()
+        time_slider_widget.SetInteractor(renderer_window_interactor)
+        time_slider_widget.SetRepresentation(generate_time_slide_bar())
+        sliders.observe(time_slider_widget, custom_time_callback, custom_time_end_callback)
+        observe_widget(time_slider_widget, 'time')
+        time_slider_widget.EnabledOn()
+    
     # Add x-axis slide bar   
     x_axis_slide_bar = generate_x_axis_slide_bar(maxX, clip[0]) if clip else generate_x_axis_slide_bar(maxX, 0)
     x_axis_slider_widget = vtk.vtkSliderWidget()
     x_axis_slider_widget.SetInteractor(renderer_window_interactor)
     x_axis_slider_widget.SetRepresentation(x_axis_slide_bar)
-    x_axis_slider_widget.AddObserver("InteractionEvent", x_axis_custom_callback)
+    sliders.observe(x_axis_slider_widget, x_axis_custom_callback, clip_end_callback)
+    observe_widget(x_axis_slider_widget, 'x clip')
     x_axis_slider_widget.EnabledOn()
     
     
@@ -310,7 +479,8 @@ def generate_gui(actors, val, clip):
     y_axis_slider_widget = vtk.vtkSliderWidget()
     y_axis_slider_widget.SetInteractor(renderer_window_interactor)
     y_axis_slider_widget.SetRepresentation(y_axis_slide_bar)
-    y_axis_slider_widget.AddObserver("InteractionEvent", y_axis_custom_callback)
+    sliders.observe(y_axis_slider_widget, y_axis_custom_callback, clip_end_callback)
+    observe_widget(y_axis_slider_widget, 'y clip')
     y_axis_slider_widget.EnabledOn()
     
     
@@ -319,7 +489,8 @@ def generate_gui(actors, val, clip):
     z_axis_slider_widget = vtk.vtkSliderWidget()
     z_axis_slider_widget.SetInteractor(renderer_window_interactor)
     z_axis_slider_widget.SetRepresentation(z_axis_slide_bar)
-    z_axis_slider_widget.AddObserver("InteractionEvent", z_axis_custom_callback)
+    sliders.observe(z_axis_slider_widget, z_axis_custom_callback, clip_end_callback)
+    observe_widget(z_axis_slider_widget, 'z clip')
     z_axis_slider_widget.EnabledOn()
     
     
@@ -357,6 +528,10 @@ def generate_gui(actors, val, clip):
     
     # Smoother camera controls
     renderer_window_interactor.GetInteractorStyle().SetCurrentStyleToTrackballCamera();
+    # coarse level while the camera moves
+    observe_camera_interaction(renderer_window_interactor, camera_start_callback, camera_end_callback)
+    # event-to-frame latency of the sliders
+    observe_window(renderer, renderer_window)
     renderer_window_interactor.Initialize()
     renderer_window.Render()
     renderer_window.SetWindowName('Isosurface')
@@ -367,18 +542,52 @@ def generate_gui(actors, val, clip):
 def main():
     # Get file paths from cli params.
     #data_file, texture_file = get_program_parameters()
-    data_file, val, clip = get_program_parameters()
+    data_file, val, clip, engine, cache_mb, cache_dir, lod_levels, mapped, voi, batch, prefetch, time_cache, blocks, tolerance, profile, latency, throttle = get_program_parameters()
+    start_profiling(profile)
+    start_latency(latency)
+    
+    global series_files, series, incremental
+    incremental = IncrementalContour(tolerance) if(blocks) else None
+    series_files = time_series_files(data_file)
+    if(series_files is not None):
+        # the first timestep sets the isovalue range
+        data_file = series_files[0] if(series_files) else None
     
     print(val)
     print(clip)
     print(min, max)
     
     # Read data file.
-    data = read_file(data_file)
+    with stage('read'):
+        data = read_file(data_file, lod_levels, mapped=mapped)
     if(data):
-        actors = generate_actors(data, val, clip)
-        # Generate GUI
-        generate_gui(actors, val, clip)        
+        global span_index, surface_cache, iso_file, clip_voi
+        clip_voi = voi
+        with stage('span index'):
+            span_index = load_span_index(data_file, data.GetOutput())
+        surface_cache = SurfaceCache(cache_mb, cache_dir)
+        iso_file = data_file
+        if(series_files):
+            series = TimeSeries(len(series_files), lambda index: read_timestep(index, lod_levels, mapped),
+                                prefetch, time_cache, release_timestep)
+            series.store(0, (data, span_index))
+            series.schedule(0)
+        with stage('generate_actors'):
+            actors = generate_actors(data, val, clip, engine)
+        watch_actors(actors)
+        if(batch and series):
+            # headless: every timestep, numbered
+            for index in range(len(series_files)):
+                set_timestep(index)
+                run_batch(actors, {'output': batch['output'] and timestep_file(batch['output'], index),
+                                   'screenshot': batch['screenshot'] and timestep_file(batch['screenshot'], index),
+                                   'size': batch['size']}, zoom=0.8)
+        elif(batch):
+            # headless: write the meshes and/or the render, then exit
+            run_batch(actors, batch, zoom=0.8)
+        else:
+            # Generate GUI
+            generate_gui(actors, val, clip, throttle)        
     else:
         print('The data file was not found or the file provided does not match neither the .vti and .vtp extension.')
     
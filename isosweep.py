@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter-study driver for isocomplete: runs a manifest of
+(data_file, grad_file, params_file, clip) jobs headless on a process pool,
+reusing the volumes loaded by a worker for the next jobs that share them, and
+reports the timing of every job.
+
+Manifest lines: <data_file> <grad_file> <params_file> [<x> <y> <z>], "-" as
+grad_file computes the gradient magnitude, lines starting with # are skipped.
+"""
+import json
+import os
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+import isocomplete
+from batch_output import mesh_writers, render_offscreen, write_actor_meshes
+from contour_engine import add_engine_argument
+from gradient_volume import load_gradient_magnitude
+from mmap_reader import add_mmap_argument
+from parallel_extract import worker_count
+
+# volumes a worker keeps loaded, by (kind, file name, mapped)
+volume_cache_size = 4
+loaded_volumes = OrderedDict()
+
+def get_program_parameters():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('manifest', help='jobs file, one "data_file grad_file params_file [x y z]" per line')
+    parser.add_argument('--jobs', dest='jobs', type=int, default=0,
+                        help='concurrent job processes (0 runs in-process, -1 uses every core)')
+    parser.add_argument('--output-dir', dest='output_dir', default='sweep',
+                        help='directory the meshes and renders are written to')
+    parser.add_argument('--format', dest='format', choices=[extension[1:] for extension in mesh_writers],
+                        default='vtp', help='mesh format')
+    parser.add_argument('--screenshot', dest='screenshot', action='store_true', help='also render every job to PNG')
+    parser.add_argument('--size', dest='size', nargs=2, type=int, default=[1024, 768],
+                        help='size of the renders')
+    parser.add_argument('--timings', dest='timings', default=None, help='per-job timings (.json)')
+    add_engine_argument(parser)
+    add_mmap_argument(parser)
+    args = parser.parse_args()
+
+    return args.manifest, args.jobs, args.output_dir, args.format, args.screenshot, args.size, args.timings, args.engine, args.mmap
+
+def read_manifest(file_name):
+    jobs = list()
+    with open(file_name) as file:
+        for line in file:
+            fields = line.split()
+            if(not fields or fields[0].startswith("#")):
+                continue
+            clip = [int(value) for value in fields[3:6]] if len(fields) >= 6 else None
+            jobs.append({'index': len(jobs), 'data_file': fields[0], 'grad_file': fields[1],
+                         'params_file': fields[2], 'clip': clip})
+    return jobs
+
+# volume of key, loaded once per worker while it stays in the cache.
+def load_volume(key, load):
+    if(key in loaded_volumes):
+        loaded_volumes.move_to_end(key)
+        return loaded_volumes[key], False
+    volume = load()
+    loaded_volumes[key] = volume
+    while(len(loaded_volumes) > volume_cache_size):
+        loaded_volumes.popitem(last=False)
+    return volume, True
+
+def job_name(job):
+    data = os.path.splitext(os.path.basename(job['data_file']))[0]
+    params = os.path.splitext(os.path.basename(job['params_file']))[0]
+    return str(job['index']).zfill(4) + '_' + data + '_' + params
+
+def run_job(job, options):
+    timing = {'index': job['index'], 'name': job_name(job), 'pid': os.getpid()}
+    start = time.perf_counter()
+    data, timing['data_loaded'] = load_volume(('data', job['data_file'], options['mapped']),
+                                              lambda: isocomplete.read_file(job['data_file'], mapped=options['mapped']))
+    if(data is None):
+        timing['error'] = 'could not read ' + job['data_file']
+        return timing
+    if(job['grad_file'] == '-'):
+        gradient_magnitude, timing['gradient_loaded'] = load_volume(
+            ('computed gradient', job['data_file'], options['mapped']),
+            lambda: load_gradient_magnitude(job['data_file'], data, options['mapped']))
+    else:
+        gradient_magnitude, timing['gradient_loaded'] = load_volume(
+            ('data', job['grad_file'], options['mapped']),
+            lambda: isocomplete.read_file(job['grad_file'], mapped=options['mapped']))
+    params = isocomplete.read_params(job['params_file'])
+    timing['load'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actors = isocomplete.generate_actors(data, gradient_magnitude, params, job['clip'], options['engine'])
+    for actor in actors:
+        actor.GetMapper().Update()
+    timing['extract'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    base = os.path.join(options['output_dir'], timing['name'])
+    timing['outputs'] = write_actor_meshes(actors, base + '.' + options['format'])
+    if(options['screenshot']):
+        timing['outputs'].append(render_offscreen(actors, base + '.png', options['size']))
+    timing['write'] = time.perf_counter() - start
+    timing['cells'] = sum(actor.GetMapper().GetInput().GetNumberOfCells() for actor in actors)
+    return timing
+
+# jobs sharing a volume, one after the other in the same worker. A job that
+# fails is recorded with its error and the next jobs still run.
+def run_group(jobs, options):
+    timings = []
+    for job in jobs:
+        try:
+            timings.append(run_job(job, options))
+        except Exception:
+            timings.append(failed_job(job, traceback.format_exc().strip().splitlines()[-1]))
+        finally:
+            # the clippers of the job observe isocomplete's shared planes.
+            for plane in (isocomplete.xplane, isocomplete.yplane, isocomplete.zplane):
+                plane.RemoveAllObservers()
+    return timings
+
+def failed_job(job, error):
+    return {'index': job['index'], 'name': job_name(job), 'pid': os.getpid(), 'error': error}
+
+def report(timing):
+    if('error' in timing):
+        print(timing['name'] + ': ' + timing['error'])
+    else:
+        print('{name}: load {load:.3f}s{reused} extract {extract:.3f}s write {write:.3f}s, {cells} cells'.format(
+            reused='' if timing['data_loaded'] else ' (reused)', **timing))
+
+def main():
+    manifest, jobs, output_dir, mesh_format, screenshot, size, timings_file, engine, mapped = get_program_parameters()
+    options = {'output_dir': output_dir, 'format': mesh_format, 'screenshot': screenshot,
+               'size': size, 'engine': engine, 'mapped': mapped}
+    os.makedirs(output_dir, exist_ok=True)
+    # jobs sharing a volume go to the same worker, which loads it once.
+    job_list = sorted(read_manifest(manifest), key=lambda job: (job['data_file'], job['grad_file'], job['index']))
+    groups = [list(group) for key, group in groupby(job_list, key=lambda job: (job['data_file'], job['grad_file']))]
+
+    start = time.perf_counter()
+    timings = []
+    if(worker_count(jobs) > 0):
+        with ProcessPoolExecutor(worker_count(jobs)) as pool:
+            futures = [(group, pool.submit(run_group, group, options)) for group in groups]
+            for group, future in futures:
+                try:
+                    group_timings = future.result()
+                except Exception as error:
+                    # the worker itself died, every job of the group is lost
+                    group_timings = [failed_job(job, repr(error)) for job in group]
+                for timing in group_timings:
+                    timings.append(timing)
+                    report(timing)
+    else:
+        for group in groups:
+            for timing in run_group(group, options):
+                timings.append(timing)
+                report(timing)
+    print(str(len(timings)) + ' jobs in {:.3f}s'.format(time.perf_counter() - start))
+
+    if(timings_file):
+        with open(timings_file, 'w') as file:
+            json.dump(sorted(timings, key=lambda timing: timing['index']), file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped volume reader for uncompressed .vti files with raw appended
+data and for MetaImage (.mhd/.mha) raw+header volumes. The voxels are exposed
+as a zero-copy NumPy-backed vtkImageData, so only the pages a filter touches
+are read from disk.
+"""
+import mmap
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+mapped_extensions = (".vti", ".mhd", ".mha")
+
+# address of the vtk arrays backed by a mapping -> (vtk array, mmap, numpy
+# view). Keeps them alive and lets release_pages find the mapping of an image.
+mapped_arrays = {}
+
+vti_types = {
+    'Int8': 'i1', 'UInt8': 'u1', 'Int16': 'i2', 'UInt16': 'u2',
+    'Int32': 'i4', 'UInt32': 'u4', 'Int64': 'i8', 'UInt64': 'u8',
+    'Float32': 'f4', 'Float64': 'f8',
+}
+
+meta_types = {
+    'MET_CHAR': 'i1', 'MET_UCHAR': 'u1', 'MET_SHORT': 'i2', 'MET_USHORT': 'u2',
+    'MET_INT': 'i4', 'MET_UINT': 'u4', 'MET_LONG': 'i4', 'MET_ULONG': 'u4',
+    'MET_LONG_LONG': 'i8', 'MET_ULONG_LONG': 'u8', 'MET_FLOAT': 'f4', 'MET_DOUBLE': 'f8',
+}
+
+def add_mmap_argument(parser):
+    parser.add_argument('--mmap', dest='mmap', action='store_true',
+                        help='memory-map uncompressed .vti and .mhd/.mha volumes instead of loading them')
+    return parser
+
+# numbers of an xml/header attribute like "0 63 0 63 0 63"
+def numbers(text, kind=float):
+    return [kind(value) for value in text.split()]
+
+def map_image(file_name, offset, dtype, extent, components, spacing, origin, name, direction=None):
+    dims = [extent[1] - extent[0] + 1, extent[3] - extent[2] + 1, extent[5] - extent[4] + 1]
+    count = dims[0] * dims[1] * dims[2] * components
+    with open(file_name, 'rb') as file:
+        # copy-on-write keeps the buffer writable for VTK without touching the file.
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    array = np.frombuffer(mapping, dtype=dtype, count=count, offset=offset)
+    if(not array.dtype.isnative):
+        print('Byte swapping ' + file_name + ', it will be loaded in memory.')
+        array = array.astype(array.dtype.newbyteorder('='))
+    if(components > 1):
+        array = array.reshape(-1, components)
+
+    scalars = numpy_support.numpy_to_vtk(array, deep=False)
+    scalars.SetName(name)
+    mapped_arrays[array_key(scalars)] = (scalars, mapping, array)
+
+    image = vtk.vtkImageData()
+    image.SetExtent(extent)
+    image.SetSpacing(spacing)
+    image.SetOrigin(origin)
+    if(direction):
+        image.SetDirectionMatrix(direction)
+    image.GetPointData().SetScalars(scalars)
+
+    # same interface as the readers (GetOutput/GetOutputPort), shallow copies only.
+    source = vtk.vtkPassThrough()
+    source.SetInputData(image)
+    source.Update()
+    return source
+
+def read_appended_header(file_name):
+    chunks = b''
+    with open(file_name, 'rb') as file:
+        while(b'<AppendedData' not in chunks):
+            chunk = file.read(1 << 16)
+            if(not chunk):
+                return None, None
+            chunks += chunk
+        start = chunks.index(b'<AppendedData')
+        marker = chunks.find(b'_', start)
+        while(marker < 0):
+            chunk = file.read(1 << 16)
+            if(not chunk):
+                return None, None
+            chunks += chunk
+            marker = chunks.find(b'_', start)
+    header = chunks[:start].decode('utf-8', 'replace') + '</VTKFile>'
+    appended = chunks[start:marker].decode('utf-8', 'replace')
+    if('encoding="raw"' not in appended):
+        return None, None
+    return ElementTree.fromstring(header), marker + 1
+
+def read_mapped_vti(file_name):
+    root, data_start = read_appended_header(file_name)
+    if(root is None or root.get('type') != 'ImageData' or root.get('compressor')):
+        return None
+    image = root.find('ImageData')
+    pieces = image.findall('Piece')
+    point_data = pieces[0].find('PointData') if len(pieces) == 1 else None
+    if(point_data is None):
+        return None
+    arrays = point_data.findall('DataArray')
+    active = point_data.get('Scalars')
+    array = next((a for a in arrays if a.get('Name') == active), arrays[0] if arrays else None)
+    if(array is None or array.get('format') != 'appended' or array.get('type') not in vti_types):
+        return None
+
+    order = '<' if root.get('byte_order', 'LittleEndian') == 'LittleEndian' else '>'
+    header_type = 'u8' if root.get('header_type') == 'UInt64' else 'u4'
+    dtype = np.dtype(order + vti_types[array.get('type')])
+    # every appended block starts with its size in bytes.
+    offset = data_start + int(array.get('offset', 0)) + np.dtype(header_type).itemsize
+    direction = numbers(image.get('Direction')) if image.get('Direction') else None
+    return map_image(file_name, offset, dtype, numbers(pieces[0].get('Extent'), int),
+                     int(array.get('NumberOfComponents', 1)), numbers(image.get('Spacing', '1 1 1')),
+                     numbers(image.get('Origin', '0 0 0')), array.get('Name'), direction)
+
+def read_mapped_meta(file_name):
+    fields = {}
+    header_size = 0
+    with open(file_name, 'rb') as file:
+        for line in file:
+            header_size += len(line)
+            key, separator, value = line.decode('utf-8', 'replace').partition('=')
+            fields[key.strip()] = value.strip()
+            if(key.strip() == 'ElementDataFile'):
+                break
+    if(fields.get('CompressedData', 'False').lower() == 'true' or fields.get('NDims', '3') != '3'
+       or fields.get('ElementType') not in meta_types):
+        return None
+    data_file = fields.get('ElementDataFile')
+    if(data_file == 'LOCAL'):
+        data_file, offset = file_name, header_size
+    elif(data_file and not re.search(r'[%\s]', data_file)):
+        data_file = os.path.join(os.path.dirname(file_name), data_file)
+        offset = int(fields.get('HeaderSize', 0))
+    else:
+        # lists of slice files are not mappable as one block.
+        return None
+
+    order = '>' if fields.get('BinaryDataByteOrderMSB', fields.get('ElementByteOrderMSB', 'False')).lower() == 'true' else '<'
+    dims = numbers(fields['DimSize'], int)
+    extent = [0, dims[0] - 1, 0, dims[1] - 1, 0, dims[2] - 1]
+    spacing = numbers(fields.get('ElementSpacing', '1 1 1'))
+    origin = numbers(fields.get('Offset', fields.get('Origin', '0 0 0')))
+    components = int(fields.get('ElementNumberOfChannels', 1))
+    return map_image(data_file, offset, np.dtype(order + meta_types[fields['ElementType']]),
+                     extent, components, spacing, origin, os.path.basename(file_name))
+
+# mapped source for file_name, or None if it can't be mapped (compressed,
+# inline or multi-piece data) and has to go through the regular reader.
+def read_mapped(file_name):
+    extension = os.path.splitext(file_name)[1].lower()
+    try:
+        if(extension == ".vti"):
+            return read_mapped_vti(file_name)
+        if(extension in (".mhd", ".mha")):
+            return read_mapped_meta(file_name)
+    except (OSError, ValueError, KeyError, ElementTree.ParseError) as error:
+        print('Could not memory-map ' + file_name + ': ' + str(error))
+    return None
+
+# vtk arrays aren't hashable, shallow copies of the image share the same one.
+def array_key(scalars):
+    return scalars.GetAddressAsString('vtkObjectBase')
+
+def mapping_of(image):
+    scalars = image.GetPointData().GetScalars() if image else None
+    mapped = mapped_arrays.get(array_key(scalars)) if scalars else None
+    return mapped[1:] if mapped else None
+
+# drops the resident pages of a mapped image. They stay in the page cache, so
+# touching them again is a cheap minor fault.
+def release_pages(image):
+    mapped = mapping_of(image)
+    if(mapped and hasattr(mapped[0], 'madvise')):
+        mapped[0].madvise(mmap.MADV_DONTNEED)
+
+# scalar range, computed one z slab at a time for mapped images so scanning
+# doesn't make the whole file resident.
+def scalar_range(image, slab_bytes=64 << 20):
+    mapped = mapping_of(image)
+    if(not mapped):
+        return image.GetScalarRange()
+    array = mapped[1]
+    values = array[:, 0] if array.ndim > 1 else array
+    step = max(slab_bytes // values.itemsize, 1)
+    low, high = None, None
+    for start in range(0, values.size, step):
+        chunk = values[start:start + step]
+        low = chunk.min() if low is None else np.minimum(low, chunk.min())
+        high = chunk.max() if high is None else np.maximum(high, chunk.max())
+        release_pages(image)
+    return float(low), float(high)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Process-pool extraction over (brick, isovalue) work units. The volume and the
+gradient are handed to the workers through shared memory, the workers send
+back plain arrays and the partial meshes are merged per isovalue with their
+seam vertices deduplicated.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from bricks import crop_surface, ghost_extent, iter_bricks, merge_surfaces, same_geometry
+from contour_engine import create_contour_filter
+
+# brick size used for parallel runs when --bricks isn't given
+parallel_brick_size = 64
+
+# per worker process: the attached volumes and the reused extraction filters
+worker_state = {}
+
+def add_workers_argument(parser):
+    parser.add_argument('--workers', dest='workers', type=int, default=0,
+                        help='extraction processes (0 runs in-process, -1 uses every core)')
+    return parser
+
+def worker_count(workers):
+    return (os.cpu_count() or 1) if workers < 0 else workers
+
+# copies the scalars of image to a new shared memory block once, workers
+# attach to it by name instead of receiving a pickled volume.
+def share_image(image):
+    scalars = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+    block = shared_memory.SharedMemory(create=True, size=max(scalars.nbytes, 1))
+    np.ndarray(scalars.shape, dtype=scalars.dtype, buffer=block.buf)[...] = scalars
+    description = {
+        'name': block.name,
+        'shape': scalars.shape,
+        'dtype': scalars.dtype.str,
+        'extent': image.GetExtent(),
+        'spacing': image.GetSpacing(),
+        'origin': image.GetOrigin(),
+        'array': image.GetPointData().GetScalars().GetName(),
+    }
+    return block, description
+
+def attach_image(description):
+    try:
+        block = shared_memory.SharedMemory(name=description['name'], track=False)
+    except TypeError:
+        # before python 3.13 attaching registers the block again, with the
+        # resource tracker the pool shares with this process, so unlink stays
+        # balanced.
+        block = shared_memory.SharedMemory(name=description['name'])
+    scalars = np.ndarray(description['shape'], dtype=description['dtype'], buffer=block.buf)
+    array = numpy_support.numpy_to_vtk(scalars, deep=False)
+    array.SetName(description['array'])
+    image = vtk.vtkImageData()
+    image.SetExtent(description['extent'])
+    image.SetSpacing(description['spacing'])
+    image.SetOrigin(description['origin'])
+    image.GetPointData().SetScalars(array)
+    return block, scalars, image
+
+def initialize_worker(data_description, gradient_description, engine):
+    blocks = []
+    images = []
+    for description in (data_description, gradient_description):
+        block, scalars, image = attach_image(description)
+        blocks.append((block, scalars))
+        images.append(image)
+    worker_state['blocks'] = blocks
+    initialize_extraction(images[0], images[1], engine)
+
+def initialize_extraction(data_image, gradient_image, engine):
+    worker_state.update(data=data_image, gradient=gradient_image)
+    voi = vtk.vtkExtractVOI()
+    voi.SetInputData(worker_state['data'])
+    iso = create_contour_filter(engine, voi)
+    probe = vtk.vtkProbeFilter()
+    probe.SetInputConnection(iso.GetOutputPort())
+    # keeps the contour normals, computed with the ghost layer
+    probe.PassPointArraysOn()
+    gradient_voi = None
+    if(same_geometry(worker_state['data'], worker_state['gradient'])):
+        gradient_voi = vtk.vtkExtractVOI()
+        gradient_voi.SetInputData(worker_state['gradient'])
+        probe.SetSourceConnection(gradient_voi.GetOutputPort())
+    else:
+        probe.SetSourceData(worker_state['gradient'])
+    worker_state.update(voi=voi, iso=iso, probe=probe, gradient_voi=gradient_voi)
+
+def mesh_to_arrays(surface):
+    point_data = surface.GetPointData()
+    arrays = {}
+    for number in range(point_data.GetNumberOfArrays()):
+        array = point_data.GetArray(number)
+        if(array and array.GetName()):
+            arrays[array.GetName()] = numpy_support.vtk_to_numpy(array).copy()
+    scalars = point_data.GetScalars()
+    normals = point_data.GetNormals()
+    polys = surface.GetPolys()
+    return {
+        'points': numpy_support.vtk_to_numpy(surface.GetPoints().GetData()).copy() if surface.GetPoints() else None,
+        'offsets': numpy_support.vtk_to_numpy(polys.GetOffsetsArray()).copy(),
+        'connectivity': numpy_support.vtk_to_numpy(polys.GetConnectivityArray()).copy(),
+        'arrays': arrays,
+        'scalars': scalars.GetName() if scalars else None,
+        'normals': normals.GetName() if normals else None,
+    }
+
+def arrays_to_mesh(arrays):
+    surface = vtk.vtkPolyData()
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(arrays['points'], deep=True))
+    surface.SetPoints(points)
+    polys = vtk.vtkCellArray()
+    polys.SetData(numpy_support.numpy_to_vtkIdTypeArray(arrays['offsets'].astype(np.int64), deep=True),
+                  numpy_support.numpy_to_vtkIdTypeArray(arrays['connectivity'].astype(np.int64), deep=True))
+    surface.SetPolys(polys)
+    for name, values in arrays['arrays'].items():
+        array = numpy_support.numpy_to_vtk(values, deep=True)
+        array.SetName(name)
+        surface.GetPointData().AddArray(array)
+    if(arrays['scalars']):
+        surface.GetPointData().SetActiveScalars(arrays['scalars'])
+    if(arrays['normals']):
+        surface.GetPointData().SetActiveNormals(arrays['normals'])
+    return surface
+
+# one work unit: the probed contour of a single isovalue inside one brick.
+def extract_unit(unit):
+    extent, value = unit
+    image = worker_state['data']
+    worker_state['voi'].SetVOI(*ghost_extent(extent, image.GetExtent()))
+    if(worker_state['gradient_voi']):
+        worker_state['gradient_voi'].SetVOI(*ghost_extent(extent, image.GetExtent()))
+    worker_state['iso'].SetValue(0, value)
+    worker_state['probe'].Update()
+    surface = crop_surface(worker_state['probe'].GetOutput(), extent, image)
+    return value, mesh_to_arrays(surface) if surface.GetNumberOfCells() else None
+
+# probed isosurface of every value, {value: vtkPolyData}, extracted over the
+# bricks of index (inside region if given) by workers processes (in this
+# process when workers is 0).
+def extract_parallel(data, gradient_magnitude, iso_values, engine, index, workers, region=None):
+    iso_values = sorted(set(iso_values))
+    units = [(extent, value) for (extent, values) in iter_bricks(index, iso_values, region) for value in values]
+    meshes = {value: [] for value in iso_values}
+    if(worker_count(workers) > 0):
+        data_block, data_description = share_image(data.GetOutput())
+        gradient_block, gradient_description = share_image(gradient_magnitude.GetOutput())
+        arguments = (data_description, gradient_description, engine)
+        try:
+            with ProcessPoolExecutor(worker_count(workers), initializer=initialize_worker, initargs=arguments) as pool:
+                # map keeps the brick order, so the merged meshes are deterministic.
+                for value, arrays in pool.map(extract_unit, units, chunksize=max(len(units) // (8 * worker_count(workers)), 1)):
+                    if(arrays):
+                        meshes[value].append(arrays_to_mesh(arrays))
+        finally:
+            for block in (data_block, gradient_block):
+                block.close()
+                block.unlink()
+    else:
+        initialize_extraction(data.GetOutput(), gradient_magnitude.GetOutput(), engine)
+        for unit in units:
+            value, arrays = extract_unit(unit)
+            if(arrays):
+                meshes[value].append(arrays_to_mesh(arrays))
+        worker_state.clear()
+    return {value: merge_surfaces(parts) for (value, parts) in meshes.items()}
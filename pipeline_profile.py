@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling of the VTK pipelines (--profile). Every filter upstream of
+the actors reports its wall time, output cells/points and resident memory
+delta through StartEvent/EndEvent, and Python-side stages such as reading or
+the span index contouring are timed as spans. The report is printed at exit
+and can be written as JSON or as a Chrome trace (chrome://tracing, Perfetto).
+"""
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import deque
+
+profile_formats = ["json", "chrome"]
+# stage executions kept for --profile-output, the report counts them all
+record_limit = 100000
+
+# the profiler of --profile, None when profiling is off
+active = None
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', dest='profile', action='store_true',
+                        help='time every pipeline stage and print a report at exit')
+    parser.add_argument('--profile-output', dest='profile_output', default=None,
+                        help='also write the per-update records to this file')
+    parser.add_argument('--profile-format', dest='profile_format', choices=profile_formats, default='json',
+                        help='format of --profile-output')
+    return parser
+
+# None without --profile, otherwise the profile outputs.
+def profile_options(parser, args):
+    if(not args.profile):
+        if(args.profile_output):
+            parser.error('--profile-output needs --profile')
+        return None
+    return {'output': args.profile_output, 'format': args.profile_format}
+
+# bytes resident, 0 where /proc isn't available.
+def resident_memory():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def output_size(algorithm):
+    # mappers and other sinks have no output
+    output = algorithm.GetOutputDataObject(0) if(algorithm.GetNumberOfOutputPorts()) else None
+    if(output is None or not hasattr(output, 'GetNumberOfCells')):
+        return None, None
+    return output.GetNumberOfCells(), output.GetNumberOfPoints()
+
+class PipelineProfiler:
+    def __init__(self):
+        self.origin = time.perf_counter()
+        # one record per stage execution, the latest record_limit of them
+        self.records = deque(maxlen=record_limit)
+        # totals per stage over every execution
+        self.stages = {}
+        self.watched = {}
+        self.counts = {}
+        self.running = {}
+        self.lock = threading.Lock()
+
+    # called with the lock held.
+    def stage_name(self, algorithm, name=None):
+        name = name or algorithm.GetClassName()
+        self.counts[name] = self.counts.get(name, 0) + 1
+        count = self.counts[name]
+        return name if count == 1 else name + '#' + str(count)
+
+    # times every execution of algorithm under name (its class by default).
+    # Extraction threads watch their filters too, so a filter is claimed under
+    # the lock and observed once.
+    def watch(self, algorithm, name=None):
+        if(algorithm is None):
+            return algorithm
+        with self.lock:
+            if(algorithm in self.watched):
+                return algorithm
+            self.watched[algorithm] = self.stage_name(algorithm, name)
+        algorithm.AddObserver("StartEvent", self.start)
+        algorithm.AddObserver("EndEvent", self.end)
+        return algorithm
+
+    # watches algorithm and every filter upstream of it.
+    def watch_pipeline(self, algorithm, name=None):
+        if(algorithm is None or algorithm in self.watched):
+            return
+        self.watch(algorithm, name)
+        for port in range(algorithm.GetNumberOfInputPorts()):
+            for index in range(algorithm.GetNumberOfInputConnections(port)):
+                self.watch_pipeline(algorithm.GetInputConnection(port, index).GetProducer())
+
+    def watch_actors(self, actors):
+        for actor in actors:
+            self.watch_pipeline(actor.GetMapper())
+
+    def start(self, algorithm, event):
+        self.running[(algorithm, threading.get_ident())] = (time.perf_counter(), resident_memory())
+
+    def end(self, algorithm, event):
+        started = self.running.pop((algorithm, threading.get_ident()), None)
+        if(started):
+            cells, points = output_size(algorithm)
+            self.record(self.watched.get(algorithm, algorithm.GetClassName()), started, cells, points)
+
+    def record(self, name, started, cells=None, points=None):
+        start, memory = started
+        record = {'stage': name, 'start': start - self.origin, 'duration': time.perf_counter() - start,
+                  'cells': cells, 'points': points, 'memory': resident_memory() - memory,
+                  'thread': threading.get_ident()}
+        with self.lock:
+            self.records.append(record)
+            stage = self.stages.setdefault(name, {'calls': 0, 'total': 0.0, 'max': 0.0, 'memory': 0,
+                                                  'cells': None, 'points': None})
+            stage['calls'] += 1
+            stage['total'] += record['duration']
+            stage['max'] = max(stage['max'], record['duration'])
+            stage['memory'] += record['memory']
+            if(cells is not None):
+                stage['cells'], stage['points'] = cells, points
+
+    # times the block as one stage, for work done outside the filters' events.
+    @contextlib.contextmanager
+    def span(self, name):
+        started = (time.perf_counter(), resident_memory())
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    # per stage: executions, total/mean/max seconds, last output size and
+    # memory delta summed over the executions.
+    def summary(self):
+        with self.lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+        for stage in stages.values():
+            stage['mean'] = stage['total'] / stage['calls']
+        return stages
+
+    def report(self):
+        stages = sorted(self.summary().items(), key=lambda item: -item[1]['total'])
+        lines = ['{:<36} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+            'stage', 'calls', 'total s', 'mean ms', 'max ms', 'cells', 'memory MB')]
+        for name, stage in stages:
+            lines.append('{:<36} {:>6} {:>10.3f} {:>10.2f} {:>10.2f} {:>10} {:>10.1f}'.format(
+                name[:36], stage['calls'], stage['total'], 1000 * stage['mean'], 1000 * stage['max'],
+                '-' if stage['cells'] is None else stage['cells'], stage['memory'] / 2**20))
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        with self.lock:
+            records = list(self.records)
+        events = [{'name': record['stage'], 'ph': 'X', 'pid': os.getpid(), 'tid': record['thread'],
+                   'ts': 1e6 * record['start'], 'dur': 1e6 * record['duration'],
+                   'args': {'cells': record['cells'], 'points': record['points'], 'memory': record['memory']}}
+                  for record in records]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, file_name, profile_format='json'):
+        if(profile_format == 'chrome'):
+            content = self.chrome_trace()
+        else:
+            with self.lock:
+                records = list(self.records)
+            content = {'stages': self.summary(), 'records': records}
+        with open(file_name, 'w') as file:
+            json.dump(content, file, indent=1)
+
+# turns profiling on for the options of profile_options, reporting at exit.
+def start_profiling(options):
+    global active
+    if(options is None):
+        return None
+    active = PipelineProfiler()
+
+    def finish():
+        print(active.report())
+        if(options['output']):
+            active.write(options['output'], options['format'])
+            print('Wrote ' + options['output'])
+    atexit.register(finish)
+    return active
+
+# span of the active profiler, nothing when profiling is off.
+def stage(name):
+    return active.span(name) if active else contextlib.nullcontext()
+
+def watch(algorithm, name=None):
+    return active.watch(algorithm, name) if active else algorithm
+
+def watch_pipeline(algorithm, name=None):
+    if(active):
+        active.watch_pipeline(algorithm, name)
+
+def watch_actors(actors):
+    if(active):
+        active.watch_actors(actors)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Coalescing of the InteractionEvent storms of the slider widgets. A dragged
+slider updates the pipeline at most once per interval; the events in between
+only remember that the slider moved, and once it has rested for the debounce
+time its latest value is applied from a one-shot interactor timer. The
+callbacks read the value from the slider when they run, so the value applied
+is always the latest one. EndInteractionEvent applies any value still pending
+and then runs the full quality end callback.
+"""
+import time
+
+from interaction_latency import hold_event, release_events
+
+def add_throttle_arguments(parser):
+    parser.add_argument('--slider-interval', dest='slider_interval', type=float, default=50,
+                        help='least milliseconds between two updates of a dragged slider (0 updates on every event)')
+    parser.add_argument('--slider-debounce', dest='slider_debounce', type=float, default=30,
+                        help='milliseconds a slider rests before its latest value is applied')
+    return parser
+
+# seconds between the updates of a slider and of rest before the last one.
+def throttle_options(args):
+    return {'interval': args.slider_interval / 1000, 'debounce': args.slider_debounce / 1000}
+
+class SliderThrottle:
+    def __init__(self, interactor, interval=0.05, debounce=0.03):
+        self.interactor = interactor
+        self.interval = interval
+        self.debounce = debounce
+        # sliders by the id of their pending timer
+        self.timers = {}
+        interactor.AddObserver("TimerEvent", self.timer)
+
+    # observes widget in place of its InteractionEvent and EndInteractionEvent observers.
+    def observe(self, widget, callback, end_callback=None):
+        slider = {'widget': widget, 'callback': callback, 'end_callback': end_callback,
+                  'latest': None, 'applied': None, 'timer': None}
+        widget.AddObserver("InteractionEvent", lambda obj, event: self.interaction(slider, obj, event))
+        widget.AddObserver("EndInteractionEvent", lambda obj, event: self.end(slider, obj, event))
+        return widget
+
+    def interaction(self, slider, obj, event):
+        now = time.perf_counter()
+        slider['latest'] = (obj, event)
+        if(slider['applied'] is None or now - slider['applied'] >= self.interval):
+            self.apply(slider)
+        else:
+            # the frame the widget renders next doesn't show this event
+            hold_event(slider['widget'])
+            self.schedule(slider, max(slider['applied'] + self.interval, now + self.debounce) - now)
+
+    def schedule(self, slider, delay):
+        self.cancel(slider)
+        timer = self.interactor.CreateOneShotTimer(max(1, int(round(1000 * delay))))
+        if(not timer):
+            # the interactor has no timers, nothing can be applied later
+            self.apply(slider)
+            return
+        slider['timer'] = timer
+        self.timers[timer] = slider
+
+    def cancel(self, slider):
+        if(slider['timer'] is not None):
+            self.interactor.DestroyTimer(slider['timer'])
+            self.timers.pop(slider['timer'], None)
+            slider['timer'] = None
+
+    def apply(self, slider):
+        self.cancel(slider)
+        obj, event = slider['latest']
+        slider['latest'] = None
+        slider['applied'] = time.perf_counter()
+        release_events(slider['widget'])
+        slider['callback'](obj, event)
+
+    # the slider rested: its latest value goes through, and is rendered since
+    # no widget event will render it.
+    def timer(self, obj, event):
+        slider = self.timers.get(obj.GetTimerEventId())
+        if(slider is None):
+            return
+        self.timers.pop(slider['timer'])
+        slider['timer'] = None
+        if(slider['latest']):
+            self.apply(slider)
+            obj.Render()
+
+    def end(self, slider, obj, event):
+        if(slider['latest']):
+            self.apply(slider)
+        else:
+            self.cancel(slider)
+        slider['applied'] = None
+        if(slider['end_callback']):
+            slider['end_callback'](obj, event)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Span-space index of per-block scalar min/max, used to contour a new isovalue
+over the blocks that straddle it instead of the whole volume.
+"""
+import os
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from bricks import crop_surface, ghost_extent, merge_surfaces
+from contour_engine import create_contour_filter
+from mmap_reader import release_pages
+from clip_voi import intersect_extents
+from pipeline_profile import watch
+
+# cells per block side. Neighbouring blocks share their boundary points.
+block_size = 32
+
+# bump when the on-disk layout changes so old indexes get rebuilt.
+index_version = 1
+
+def scalars_as_array(image):
+    scalars = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+    if(scalars.ndim > 1):
+        # the contour filters work on the first component.
+        scalars = scalars[:, 0]
+    dims = image.GetDimensions()
+    return scalars.reshape(dims[2], dims[1], dims[0])
+
+# min/max of every block, including the points shared with the next block so
+# cells on a block boundary are accounted for.
+def reduce_blocks(volume, size, reduce):
+    for axis in range(3):
+        n = volume.shape[axis]
+        starts = np.arange(0, max(n - 1, 1), size)
+        ends = np.minimum(starts + size, n - 1)
+        volume = reduce(reduce.reduceat(volume, starts, axis=axis), np.take(volume, ends, axis=axis))
+    return volume
+
+def build_span_index(image, size=block_size):
+    volume = scalars_as_array(image)
+    mins = []
+    maxs = []
+    # one layer of blocks at a time, so memory-mapped volumes never become
+    # fully resident.
+    for start in range(0, max(volume.shape[0] - 1, 1), size):
+        slab = volume[start:start + size + 1]
+        mins.append(reduce_blocks(slab, size, np.minimum))
+        maxs.append(reduce_blocks(slab, size, np.maximum))
+        release_pages(image)
+    return make_span_index(np.concatenate(mins), np.concatenate(maxs), size, image.GetExtent())
+
+# span space: blocks sorted by min, so the candidates for a value are a prefix
+# of the order and only their max has to be checked.
+def make_span_index(mins, maxs, size, extent):
+    order = np.argsort(mins, axis=None, kind='stable')
+    return {
+        'mins': mins,
+        'maxs': maxs,
+        'size': int(size),
+        'extent': tuple(int(e) for e in extent),
+        'order': order,
+        'sorted_mins': mins.ravel()[order],
+    }
+
+# one file per block size, so tools indexing with different sizes don't
+# overwrite each other's index.
+def span_index_file(file_name, size):
+    path, extension = os.path.splitext(file_name)
+    return path + '.span' + str(size) + '.npz'
+
+def source_signature(file_name):
+    stat = os.stat(file_name)
+    return np.array([index_version, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+def save_span_index(file_name, index):
+    try:
+        with open(span_index_file(file_name, index['size']), 'wb') as file:
+            np.savez(file, mins=index['mins'], maxs=index['maxs'], size=index['size'],
+                     extent=index['extent'], signature=source_signature(file_name))
+    except OSError as error:
+        # read-only data directories just rebuild next session.
+        print('Could not save the span index: ' + str(error))
+
+def load_span_index(file_name, image, size=block_size):
+    index_file = span_index_file(file_name, size)
+    if(os.path.exists(index_file)):
+        try:
+            with np.load(index_file) as saved:
+                if(np.array_equal(saved['signature'], source_signature(file_name))
+                   and int(saved['size']) == size
+                   and tuple(saved['extent']) == tuple(image.GetExtent())):
+                    return make_span_index(saved['mins'], saved['maxs'], size, saved['extent'])
+        except (OSError, KeyError, ValueError):
+            pass
+    index = build_span_index(image, size)
+    save_span_index(file_name, index)
+    return index
+
+# (bz, by, bx) mask of the blocks whose range contains value.
+def active_blocks(index, value):
+    count = np.searchsorted(index['sorted_mins'], value, side='right')
+    candidates = index['order'][:count]
+    candidates = candidates[index['maxs'].ravel()[candidates] >= value]
+    active = np.zeros(index['mins'].size, dtype=bool)
+    active[candidates] = True
+    return active.reshape(index['mins'].shape)
+
+# VOI extents covering the active blocks, one per run of consecutive active
+# blocks along x in each block row.
+def active_extents(index, value):
+    size = index['size']
+    x0, x1, y0, y1, z0, z1 = index['extent']
+    active = active_blocks(index, value)
+    extents = []
+    for k, j in zip(*np.nonzero(active.any(axis=2))):
+        row = np.concatenate(([False], active[k, j], [False]))
+        edges = np.flatnonzero(row[1:] != row[:-1])
+        for start, stop in zip(edges[0::2], edges[1::2]):
+            extents.append((x0 + start * size, min(x0 + stop * size, x1),
+                            y0 + j * size, min(y0 + (j + 1) * size, y1),
+                            z0 + k * size, min(z0 + (k + 1) * size, z1)))
+    return extents
+
+# one VOI and contour filter reused over every region, so a new isovalue
+# doesn't build a pipeline per region.
+class RegionContour:
+    # name tells the filters apart in the profile.
+    def __init__(self, name='span index'):
+        self.name = name
+        self.voi = vtk.vtkExtractVOI()
+        self.iso = None
+        self.engine = None
+
+    # isosurface of data at value over extent. The region is contoured with a
+    # one point ghost layer, so the normals on its boundary match a contour of
+    # the whole volume, and cropped back to its own cells.
+    def contour(self, data, extent, value, engine):
+        image = data.GetOutput()
+        self.voi.SetInputConnection(data.GetOutputPort())
+        if(self.iso is None or self.engine != engine):
+            self.iso = create_contour_filter(engine, self.voi)
+            self.engine = engine
+        # watched here, the regions are built before profiling starts.
+        watch(self.voi, 'vtkExtractVOI (' + self.name + ')')
+        watch(self.iso, self.iso.GetClassName() + ' (' + self.name + ')')
+        self.voi.SetVOI(*ghost_extent(extent, image.GetExtent()))
+        self.iso.SetValue(0, value)
+        self.iso.Update()
+        # the next Update allocates new arrays, so a shallow copy is enough.
+        surface = vtk.vtkPolyData()
+        surface.ShallowCopy(self.iso.GetOutput())
+        return crop_surface(surface, extent, image)
+
+# isosurface of data at value computed over the active regions of index only,
+# and only inside region if given, with the seams between regions merged.
+def contour_active_regions(contour, data, index, value, engine, region=None):
+    surfaces = []
+    for extent in active_extents(index, value):
+        if(region):
+            extent = intersect_extents(extent, region)
+            if(extent is None):
+                continue
+        surfaces.append(contour.contour(data, extent, value, engine))
+    # the regions were copied out by the VOI filter.
+    release_pages(data.GetOutput())
+    return merge_surfaces(surfaces)
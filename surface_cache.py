@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+LRU cache of extracted isosurfaces keyed by (file, quantized isovalue,
+engine, clip region), bounded by a memory budget and optionally spilling
+evicted surfaces to disk as compressed .vtp files. The spilled files are
+deleted by clear() and at exit.
+"""
+import atexit
+import hashlib
+import os
+from collections import OrderedDict
+
+import vtk
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache-mb', dest='cache_mb', type=float, default=256,
+                        help='memory budget of the isosurface cache in MB (0 disables it)')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=None,
+                        help='directory evicted isosurfaces are spilled to as .vtp')
+    return parser
+
+# isovalues closer than quantum share a cache entry.
+def quantize(value, quantum=1.0):
+    return round(value / quantum) * quantum
+
+class SurfaceCache:
+    def __init__(self, budget_mb=256, spill_dir=None, quantum=1.0):
+        self.budget = int(budget_mb * 1024) # KiB, like GetActualMemorySize
+        self.spill_dir = spill_dir
+        self.quantum = quantum
+        self.entries = OrderedDict()
+        self.size = 0
+        self.spilled = {}
+        self.hits = 0
+        self.misses = 0
+        if(spill_dir):
+            os.makedirs(spill_dir, exist_ok=True)
+            atexit.register(self.clear)
+
+    # region is the extent the surface was restricted to, None for the whole volume.
+    def key(self, file_name, value, engine, region=None):
+        return (os.path.abspath(file_name) if file_name else None, quantize(value, self.quantum), engine, region)
+
+    def __contains__(self, key):
+        return key in self.entries or key in self.spilled
+
+    def get(self, key):
+        if(key in self.entries):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if(key in self.spilled):
+            surface = self.read_spilled(key)
+            if(surface):
+                self.hits += 1
+                self.put(key, surface)
+                return surface
+        self.misses += 1
+        return None
+
+    # stores a copy of surface, so the caller's pipeline can keep reusing its output.
+    def put(self, key, surface):
+        if(self.budget <= 0 and not self.spill_dir):
+            return surface
+        if(key in self.entries):
+            self.size -= self.entries.pop(key).GetActualMemorySize()
+        entry = vtk.vtkPolyData()
+        entry.DeepCopy(surface)
+        self.entries[key] = entry
+        self.size += entry.GetActualMemorySize()
+        self.evict()
+        return entry
+
+    def evict(self):
+        # the newest entry stays even if it alone is over budget.
+        while(self.size > self.budget and len(self.entries) > 1 or self.budget <= 0 and self.entries):
+            key, surface = self.entries.popitem(last=False)
+            self.size -= surface.GetActualMemorySize()
+            if(self.spill_dir and key not in self.spilled):
+                self.spill(key, surface)
+
+    def spill_file(self, key):
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.spill_dir, name + '.vtp')
+
+    def spill(self, key, surface):
+        writer = vtk.vtkXMLPolyDataWriter()
+        writer.SetFileName(self.spill_file(key))
+        writer.SetInputData(surface)
+        writer.SetDataModeToAppended()
+        writer.SetCompressorTypeToZLib()
+        if(writer.Write()):
+            self.spilled[key] = writer.GetFileName()
+
+    def read_spilled(self, key):
+        file_name = self.spilled[key]
+        if(not os.path.exists(file_name)):
+            del self.spilled[key]
+            return None
+        reader = vtk.vtkXMLPolyDataReader()
+        reader.SetFileName(file_name)
+        reader.Update()
+        return reader.GetOutput()
+
+    # a surface read back keeps its file, so evicting it again writes nothing.
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+        for file_name in self.spilled.values():
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+        self.spilled.clear()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental contouring across timesteps: the volume is compared with the
+previous one block by block, and only the blocks of the span index whose
+values changed are contoured again. The triangles of the other blocks are
+reused from the previous surface.
+"""
+import numpy as np
+
+from bricks import merge_surfaces
+from clip_voi import intersect_extents
+from mmap_reader import release_pages
+from span_index import RegionContour, active_blocks, reduce_blocks, scalars_as_array
+
+def add_incremental_arguments(parser):
+    parser.add_argument('--incremental', dest='incremental', action='store_true',
+                        help='re-contour only the blocks that changed since the previous timestep')
+    parser.add_argument('--temporal-tolerance', dest='temporal_tolerance', type=float, default=0.0,
+                        help='largest change of a block still reusing its previous triangles')
+    return parser
+
+def block_extent(index, block):
+    size = index['size']
+    x0, x1, y0, y1, z0, z1 = index['extent']
+    k, j, i = block
+    return (x0 + i * size, min(x0 + (i + 1) * size, x1),
+            y0 + j * size, min(y0 + (j + 1) * size, y1),
+            z0 + k * size, min(z0 + (k + 1) * size, z1))
+
+class IncrementalContour:
+    def __init__(self, tolerance=0.0):
+        self.tolerance = tolerance
+        # the previous image, kept so its scalars can be compared with the next
+        self.image = None
+        # isovalue, engine and geometry the block surfaces were contoured at
+        self.state = None
+        # (extent, surface) of every active block by (k, j, i)
+        self.surfaces = {}
+        # blocks contoured and reused by the last call
+        self.contoured = 0
+        self.reused = 0
+        self.region = RegionContour('incremental')
+
+    # (bz, by, bx) mask of the blocks of image whose values moved by more than
+    # the tolerance since the previous image.
+    def changed_blocks(self, image, index):
+        if(image is self.image):
+            return np.zeros(index['mins'].shape, dtype=bool)
+        previous = scalars_as_array(self.image)
+        current = scalars_as_array(image)
+        size = index['size']
+        changed = np.zeros(index['mins'].shape, dtype=bool)
+        # one layer of blocks at a time, with the points it shares with the next
+        for k in range(changed.shape[0]):
+            z0 = k * size
+            z1 = min(z0 + size, current.shape[0] - 1) + 1
+            difference = np.abs(current[z0:z1].astype(np.float64) - previous[z0:z1])
+            changed[k] = reduce_blocks(difference, size, np.maximum)[0] > self.tolerance
+        # the ghost layer of a block reaches into its neighbours, whose changes
+        # move its normals.
+        padded = np.pad(changed, 1)
+        bz, by, bx = changed.shape
+        for dz in range(3):
+            for dy in range(3):
+                for dx in range(3):
+                    changed = changed | padded[dz:dz + bz, dy:dy + by, dx:dx + bx]
+        return changed
+
+    # isosurface of data at value over the active blocks of index, inside
+    # region if given.
+    def contour(self, data, index, value, engine, region=None):
+        image = data.GetOutput()
+        state = (value, engine, index['size'], image.GetExtent(), image.GetSpacing(), image.GetOrigin())
+        if(state != self.state or self.image is None):
+            self.surfaces = {}
+            changed = np.ones(index['mins'].shape, dtype=bool)
+        else:
+            changed = self.changed_blocks(image, index)
+
+        surfaces = {}
+        self.contoured = self.reused = 0
+        for block in map(tuple, np.argwhere(active_blocks(index, value))):
+            extent = block_extent(index, block)
+            if(region):
+                extent = intersect_extents(extent, region)
+                if(extent is None):
+                    continue
+            previous = self.surfaces.get(block)
+            if(previous and previous[0] == extent and not changed[block]):
+                surfaces[block] = previous
+                self.reused += 1
+            else:
+                surfaces[block] = (extent, self.region.contour(data, extent, value, engine))
+                self.contoured += 1
+
+        # the blocks were copied out by the VOI filter.
+        release_pages(image)
+        self.image = image
+        self.state = state
+        self.surfaces = surfaces
+        return merge_surfaces([surface for extent, surface in surfaces.values()])
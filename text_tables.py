@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Loader for the whitespace-separated isovalue, colormap and params files.
+Each file is parsed in one numpy.loadtxt call into a structured array, and
+can be cached as a binary .npy next to the text file.
+"""
+import os
+import numpy as np
+
+# <value>
+isovalue_dtype = np.dtype([('value', np.float64)])
+# <value> <r> <g> <b>
+cmap_dtype = np.dtype([('value', np.float64), ('rgb', np.float32, 3)])
+# <value> <min_grad> <max_grad> <r> <g> <b> <a>
+params_dtype = np.dtype([('value', np.float64), ('gradient', np.float64, 2), ('rgba', np.float32, 4)])
+# <min_value> <max_value> <min_grad> <max_grad> <r> <g> <b> <a>
+region_dtype = np.dtype([('value', np.float64, 2), ('gradient', np.float64, 2), ('rgba', np.float32, 4)])
+
+def add_table_cache_argument(parser):
+    parser.add_argument('--cache-tables', dest='cache_tables', action='store_true',
+                        help='keep the parsed text files as .npy next to them')
+    return parser
+
+def table_cache_file(file_name):
+    return file_name + '.npy'
+
+def read_cached_table(file_name, dtype):
+    cache_file = table_cache_file(file_name)
+    try:
+        if(os.path.getmtime(cache_file) < os.path.getmtime(file_name)):
+            return None
+        table = np.load(cache_file, allow_pickle=False)
+    except (OSError, ValueError):
+        return None
+    return table if table.dtype == dtype else None
+
+def save_table(file_name, table):
+    try:
+        np.save(table_cache_file(file_name), table, allow_pickle=False)
+    except OSError as error:
+        # read-only directories just parse the text again next time.
+        print('Could not cache ' + file_name + ': ' + str(error))
+
+# rows of file_name as a structured array of dtype. Columns are separated by
+# any run of spaces or tabs, # starts a comment and blank lines are skipped.
+def load_table(file_name, dtype, cache=False):
+    if(cache):
+        table = read_cached_table(file_name, dtype)
+        if(table is not None):
+            return table
+    with open(file_name) as file:
+        rows = [line for line in file if line.strip() and not line.lstrip().startswith('#')]
+    if(rows):
+        table = np.loadtxt(rows, dtype=dtype, comments='#', ndmin=1)
+    else:
+        table = np.zeros(0, dtype=dtype)
+    if(cache):
+        save_table(file_name, table)
+    return table
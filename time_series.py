@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Time-series input: a glob pattern or a .pvd collection of per-timestep
+volumes. A background thread reads the next timesteps while the current one
+renders, into a bounded cache of decoded volumes.
+"""
+import glob
+import os
+import re
+import threading
+import xml.etree.ElementTree as ElementTree
+from collections import OrderedDict
+
+from gradient_volume import gradient_cache_file
+
+def add_time_series_arguments(parser):
+    parser.add_argument('--prefetch', dest='prefetch', type=int, default=2,
+                        help='timesteps read ahead when data_file is a glob pattern or a .pvd')
+    parser.add_argument('--time-cache', dest='time_cache', type=int, default=4,
+                        help='decoded timesteps kept in memory')
+    return parser
+
+# "file10" after "file9"
+def natural_key(file_name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', file_name)]
+
+def read_pvd(file_name):
+    directory = os.path.dirname(file_name)
+    datasets = ElementTree.parse(file_name).getroot().iter('DataSet')
+    steps = sorted((float(dataset.get('timestep', 0)), int(dataset.get('part', 0)), dataset.get('file'))
+                   for dataset in datasets if dataset.get('file'))
+    # the first part of every timestep
+    files = OrderedDict()
+    for timestep, part, name in steps:
+        files.setdefault(timestep, os.path.join(directory, name))
+    return list(files.values())
+
+# files of the timesteps of file_name, None if it is a single volume.
+def time_series_files(file_name):
+    if(not file_name):
+        return None
+    if(os.path.splitext(file_name)[1].lower() == ".pvd"):
+        return read_pvd(file_name)
+    if(glob.has_magic(file_name)):
+        files = glob.glob(file_name)
+        # the gradients computed next to the timesteps match the pattern too
+        computed = set(gradient_cache_file(name) for name in files)
+        return sorted((name for name in files if name not in computed), key=natural_key)
+    return None
+
+# file_name numbered for the timestep at index, for the batch outputs.
+def timestep_file(file_name, index):
+    path, extension = os.path.splitext(file_name)
+    return path + '_t' + str(index).zfill(4) + extension
+
+class TimeSeries:
+    # read(index) loads timestep index, whatever it returns is cached.
+    # release(volume) is called on the volumes evicted from the cache.
+    def __init__(self, count, read, prefetch=2, cache_size=4, release=None):
+        self.count = count
+        self.read = read
+        self.release = release
+        self.prefetch = prefetch
+        # the current timestep, the prefetched ones and one still being read
+        # for a previous position have to fit.
+        self.cache_size = max(cache_size, prefetch + 2)
+        self.cache = OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.wanted = []
+        self.wake = threading.Condition(self.lock)
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return self.count
+
+    # prefetches the timesteps after index, wrapping around for playback.
+    def schedule(self, index):
+        with self.lock:
+            self.wanted = [(index + step) % self.count for step in range(1, self.prefetch + 1)]
+            self.wake.notify()
+
+    # timestep index, read now unless it is cached or being prefetched.
+    def get(self, index):
+        self.schedule(index)
+        with self.lock:
+            if(index in self.cache):
+                self.cache.move_to_end(index)
+                return self.cache[index]
+            loaded = self.loading.get(index)
+        if(loaded):
+            loaded.wait()
+            with self.lock:
+                if(index in self.cache):
+                    return self.cache[index]
+        return self.store(index, self.read(index))
+
+    def store(self, index, volume):
+        with self.lock:
+            self.cache[index] = volume
+            self.cache.move_to_end(index)
+            evicted = []
+            while(len(self.cache) > self.cache_size):
+                evicted.append(self.cache.popitem(last=False)[1])
+        if(self.release):
+            for old in evicted:
+                self.release(old)
+        return volume
+
+    def run(self):
+        while(True):
+            with self.lock:
+                while(not self.stopped and not any(index not in self.cache for index in self.wanted)):
+                    self.wake.wait()
+                if(self.stopped):
+                    return
+                index = next(index for index in self.wanted if index not in self.cache)
+                loaded = self.loading[index] = threading.Event()
+            try:
+                self.store(index, self.read(index))
+            except Exception as error:
+                print('Could not prefetch timestep ' + str(index) + ': ' + str(error))
+                with self.lock:
+                    self.wanted.remove(index)
+            finally:
+                with self.lock:
+                    del self.loading[index]
+                loaded.set()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.wake.notify()
+        self.thread.join()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Transfer function held as contiguous float32 arrays of control values and
+RGBA colors. Lookups are vectorized over any number of scalars, and the
+function is baked once into a vtkLookupTable shared by every mapper and
+scalar bar that shows it.
+"""
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+# entries of the baked lookup tables
+table_size = 256
+
+class TransferFunction:
+    # values: (n,) control points, rgba: (n, 4) colors in 0..1.
+    def __init__(self, values, rgba):
+        values = np.asarray(values, dtype=np.float32).reshape(-1)
+        order = np.argsort(values, kind='stable')
+        self.values = np.ascontiguousarray(values[order])
+        self.rgba = np.ascontiguousarray(np.asarray(rgba, dtype=np.float32).reshape(-1, 4)[order])
+        self.table = None
+
+    @classmethod
+    def from_rgb(cls, values, rgb, opacity=1.0):
+        rgb = np.asarray(rgb, dtype=np.float32).reshape(-1, 3)
+        return cls(values, np.hstack((rgb, np.full((len(rgb), 1), opacity, dtype=np.float32))))
+
+    def __len__(self):
+        return len(self.values)
+
+    def range(self):
+        return float(self.values[0]), float(self.values[-1])
+
+    # (len(scalars), 4) colors, linear between the control points and clamped
+    # past the ends like vtkColorTransferFunction.
+    def lookup(self, scalars):
+        scalars = np.asarray(scalars, dtype=np.float32).reshape(-1)
+        return np.stack([np.interp(scalars, self.values, self.rgba[:, channel]) for channel in range(4)],
+                        axis=1).astype(np.float32)
+
+    # the function sampled into a vtkLookupTable over its range, built on the
+    # first call and shared afterwards. Mappers using it need
+    # UseLookupTableScalarRangeOn so they don't rescale it.
+    def lookup_table(self, size=table_size):
+        if(self.table is None):
+            low, high = self.range()
+            colors = self.lookup(np.linspace(low, high, size))
+            self.table = vtk.vtkLookupTable()
+            self.table.SetNumberOfTableValues(size)
+            self.table.SetTableRange(*axis_range((low, high)))
+            self.table.SetTable(numpy_support.numpy_to_vtk(np.rint(colors * 255).astype(np.uint8), deep=True))
+        return self.table
+
+class TransferFunction2D:
+    # value x gradient magnitude table of shape (values, gradients, 4). The
+    # base colors follow the 1D function colors along the gradient axis for
+    # every value, regions are painted over them.
+    def __init__(self, value_range, gradient_range, colors, shape=(table_size, table_size)):
+        self.ranges = [axis_range(value_range), axis_range(gradient_range)]
+        self.shape = tuple(shape)
+        self.colors = colors
+        gradient_colors = colors.lookup(self.centers(1))
+        self.base = np.ascontiguousarray(np.broadcast_to(gradient_colors, self.shape + (4,)))
+        self.regions = []
+        # gradient window, the vertices outside it are fully transparent
+        self.window = None
+        self.table = None
+
+    # bin centers along axis 0 (values) or 1 (gradients)
+    def centers(self, axis):
+        low, high = self.ranges[axis]
+        count = self.shape[axis]
+        return low + (np.arange(count) + 0.5) * (high - low) / count
+
+    def bins(self, scalars, axis):
+        low, high = self.ranges[axis]
+        count = self.shape[axis]
+        return np.clip(((scalars - low) * (count / (high - low))).astype(np.int64), 0, count - 1)
+
+    # paints rgba over the bins whose centers are inside both ranges.
+    def add_region(self, value_range, gradient_range, rgba):
+        self.regions.append((value_range, gradient_range, np.asarray(rgba, dtype=np.float32)))
+        self.table = None
+
+    def set_gradient_window(self, low, high):
+        self.window = (low, high)
+
+    def rasterize(self):
+        if(self.table is None):
+            table = self.base.copy()
+            values, gradients = self.centers(0), self.centers(1)
+            for (v0, v1), (g0, g1), rgba in self.regions:
+                rows = (values >= v0) & (values <= v1)
+                columns = (gradients >= g0) & (gradients <= g1)
+                table[np.ix_(rows, columns)] = rgba
+            self.table = table
+        return self.table
+
+    # (n, 4) colors of n vertices in one vectorized lookup. The window is
+    # applied to the exact gradients, not their bins.
+    def lookup(self, values, gradients):
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        gradients = np.asarray(gradients, dtype=np.float64).reshape(-1)
+        colors = self.rasterize()[self.bins(values, 0), self.bins(gradients, 1)]
+        if(self.window):
+            low, high = self.window
+            colors[:, 3] *= (gradients >= low) & (gradients <= high)
+        return colors
+
+def axis_range(scalar_range):
+    low, high = float(scalar_range[0]), float(scalar_range[1])
+    return (low, high if high > low else low + 1)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Mip-style pyramid of downsampled volumes built by read_file. Interactive
+updates contour (and probe) a coarse level and switch back to the finest one
+once the slider or camera goes idle.
+"""
+import vtk
+
+# coarsest level of the automatic pyramid fits in this many points per axis
+lod_target_size = 128
+lod_max_levels = 5
+
+# pyramids by reader; level 0 is the reader itself
+pyramids = {}
+
+def add_lod_arguments(parser):
+    parser.add_argument('--lod-levels', dest='lod_levels', type=int, default=None,
+                        help='downsampled levels built by read_file (default: until the '
+                        'coarsest fits in ' + str(lod_target_size) + '^3, 0 disables LOD)')
+    return parser
+
+def auto_levels(image):
+    dims = list(image.GetDimensions())
+    levels = 0
+    while(max(dims) > lod_target_size and levels < lod_max_levels):
+        dims = [(d + 1) // 2 for d in dims]
+        levels += 1
+    return levels
+
+# every level halves the previous one by averaging. Levels are only executed
+# the first time they are requested and the shrink filters keep their output.
+def build_pyramid(data, levels=None):
+    if(levels is None):
+        levels = auto_levels(data.GetOutput())
+    pyramid = [data]
+    for level in range(levels):
+        shrink = vtk.vtkImageShrink3D()
+        shrink.SetInputConnection(pyramid[-1].GetOutputPort())
+        shrink.SetShrinkFactors(2, 2, 2)
+        shrink.AveragingOn()
+        pyramid.append(shrink)
+    pyramids[data] = pyramid
+    return pyramid
+
+def coarsest_level(data):
+    return len(pyramids.get(data, [data])) - 1
+
+def pyramid_level(data, level):
+    pyramid = pyramids.get(data, [data])
+    return pyramid[min(level, len(pyramid) - 1)]
+
+# camera moves are reported by the active interactor style, not the switch.
+def observe_camera_interaction(interactor, start_callback, end_callback):
+    style = interactor.GetInteractorStyle()
+    if(hasattr(style, "GetCurrentStyle") and style.GetCurrentStyle()):
+        style = style.GetCurrentStyle()
+    style.AddObserver("StartInteractionEvent", start_callback)
+    style.AddObserver("EndInteractionEvent", end_callback)
+    return style
+
+# drops the levels of a volume that is no longer used.
+def release_pyramid(data):
+    pyramids.pop(data, None)